@@ -0,0 +1,297 @@
+"""Микробенчмарки горячих путей движка с сохранёнными эталонами.
+
+Каждая функция движка замеряется по отдельности на встроенных уровнях и
+на сгенерированных больших картах, без окна (SDL dummy-драйвер).
+Результаты (лучшая из нескольких повторов медиана и p90 времени одного
+вызова) сравниваются с эталонным файлом; замедление больше порога
+считается регрессией, и скрипт завершается с кодом 1.
+
+    python benchmarks.py --save          # записать эталон
+    python benchmarks.py                 # сравнить с эталоном
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pygame
+
+from main import (BASE_DIR, MAX_DEPTH, NUM_RAYS, DoomGame, RayCaster, Vector2, generated_level_path)
+
+BASELINE_PATH = os.path.join(BASE_DIR, ".cache", "benchmarks.json")
+BASELINE_VERSION = 2  # 2: is_wall_between делится на фактическое число пар
+DEFAULT_SIZES = ("256x256", "1024x1024")
+DEFAULT_THRESHOLD = 0.25
+# Точек обзора на уровень: камера расставляется по маршруту бенчмарка
+POSES = 8
+# Вызовов функции в каждой точке обзора
+CALLS = 10
+# Повторов каждого бенчмарка; в зачёт идёт лучшая медиана — она меньше всего зависит от фонового шума
+REPEATS = 3
+# Пар «игрок — враг» для is_wall_between в каждой точке обзора
+WALL_PAIRS = 64
+
+
+class Bench:
+    """Контекст замеров на одном уровне: игра с загруженным уровнем и позы камеры"""
+
+    def __init__(self, game: DoomGame, level_num: int):
+        self.game = game
+        self.level_num = level_num
+        game.current_level = level_num
+        game.load_level(level_num)
+        game.game_state = "playing"
+        game.player.god_mode = True
+        game.alpha = 1.0
+        self.poses = list(game.scripted_path(POSES))
+
+    def place(self, pose):
+        """Ставим камеру в позу (без интерполяции)"""
+        player = self.game.player
+        player.pos.x, player.pos.y, player.angle = pose
+        player.save_pose()
+        self.game.enemy_store.save_positions()
+
+    def measure(self, prepare, call, calls: int = CALLS) -> list:
+        """Время каждого вызова call(arg) в секундах; prepare(pose) готовит аргументы позы"""
+        times = []
+        for pose in self.poses:
+            self.place(pose)
+            args = prepare(pose)
+            for i in range(calls):
+                start = time.perf_counter()
+                call(args, i)
+                times.append(time.perf_counter() - start)
+        return times
+
+
+def bench_cast_ray(bench: Bench) -> list:
+    """Один луч скалярного cast_ray из веера лучей"""
+    game = bench.game
+    return bench.measure(lambda pose: RayCaster.ray_fan(pose[2], NUM_RAYS).tolist(),
+                         lambda angles, i: game.cast_ray(angles[i * len(angles) // CALLS]))
+
+
+def bench_render_3d(bench: Bench) -> list:
+    game = bench.game
+    return bench.measure(lambda pose: None, lambda _, i: game.render_3d())
+
+
+def bench_render_sprites(bench: Bench) -> list:
+    game = bench.game
+    return bench.measure(lambda pose: game.render_3d(), lambda z_buffer, i: game.render_sprites(z_buffer))
+
+
+def bench_render_hud(bench: Bench) -> list:
+    """HUD с меняющимся счётом — иначе замеряется только вывод готового слоя"""
+    game = bench.game
+
+    def call(_, i):
+        game.player.score += i
+        game.render_hud()
+
+    return bench.measure(lambda pose: None, call)
+
+
+def bench_render_minimap(bench: Bench) -> list:
+    game = bench.game
+    return bench.measure(lambda pose: None, lambda _, i: game.render_minimap())
+
+
+def bench_update_enemies(bench: Bench) -> list:
+    """Шаг ИИ всех врагов; игрок бессмертен, время симуляции идёт как в игре"""
+    game = bench.game
+
+    def call(_, i):
+        game.sim_time += game.sim_dt
+        game.update_enemies(game.sim_dt, game.sim_time)
+
+    return bench.measure(lambda pose: None, call)
+
+
+def bench_handle_shooting(bench: Bench) -> list:
+    """Выстрел без ограничения скорострельности и патронов"""
+    game = bench.game
+    weapon = game.player.weapon
+
+    def call(_, i):
+        weapon.last_shot = -math.inf
+        weapon.ammo = weapon.max_ammo
+        game.handle_shooting(game.sim_time)
+
+    return bench.measure(lambda pose: None, call)
+
+
+def bench_is_wall_between(bench: Bench) -> list:
+    """Видимость от игрока до ближайших врагов (или точек вокруг, если врагов рядом нет)"""
+    game = bench.game
+    counts = []
+
+    def prepare(pose):
+        x, y, _ = pose
+        targets = [enemy.pos for enemy in game.enemy_grid.query_radius(x, y, MAX_DEPTH)][:WALL_PAIRS]
+        if not targets:
+            targets = [Vector2(x + math.cos(a) * MAX_DEPTH / 2, y + math.sin(a) * MAX_DEPTH / 2)
+                       for a in np.linspace(0, 2 * math.pi, WALL_PAIRS, endpoint=False)]
+        counts.append(len(targets))
+        return targets
+
+    def call(targets, i):
+        for target in targets:
+            game.is_wall_between(game.player.pos, target)
+
+    times = bench.measure(prepare, call, calls=1)
+    # Приводим ко времени одной проверки: врагов рядом бывает меньше WALL_PAIRS
+    return [t / count for t, count in zip(times, counts)]
+
+
+BENCHMARKS = {
+    "cast_ray": bench_cast_ray,
+    "render_3d": bench_render_3d,
+    "render_sprites": bench_render_sprites,
+    "render_hud": bench_render_hud,
+    "render_minimap": bench_render_minimap,
+    "update_enemies": bench_update_enemies,
+    "handle_shooting": bench_handle_shooting,
+    "is_wall_between": bench_is_wall_between,
+}
+
+
+def environment() -> dict:
+    """То, от чего зависят абсолютные времена: эталон с другой машины сравнивать бессмысленно"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(levels: list, names: list, workers: int, repeats: int = REPEATS) -> dict:
+    """Прогоняем выбранные бенчмарки на всех уровнях: {"уровень/функция": {"median_us", "p90_us", "calls"}}"""
+    # Без фоновой сборки следующего уровня: она отнимала бы процессор у замеров
+    game = DoomGame(headless=True, max_fps=0, levels=[path for _, path in levels], seed=0, workers=workers,
+                    preload=False)
+    results = {}
+    try:
+        for level_num, (label, _) in enumerate(levels, 1):
+            for name in names:
+                best = None
+                for _ in range(repeats):
+                    # Каждый повтор — на свежезагруженном уровне: стрельба и ИИ меняют состояние
+                    times_us = np.array(BENCHMARKS[name](Bench(game, level_num))) * 1e6
+                    stats = {
+                        "median_us": float(np.median(times_us)),
+                        "p90_us": float(np.percentile(times_us, 90)),
+                        "calls": len(times_us),
+                    }
+                    if best is None or stats["median_us"] < best["median_us"]:
+                        best = stats
+                results[f"{label}/{name}"] = best
+                print(f"{label:>12} {name:<16} {best['median_us']:>12.1f} us", file=sys.stderr)
+    finally:
+        game.profiler.close()
+        game.render_pool.close()
+        pygame.quit()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Печатаем таблицу сравнения с эталоном и возвращаем регрессии"""
+    regressions = []
+    print(f"{'benchmark':<32} {'median us':>11} {'p90 us':>11} {'baseline':>11} {'change':>8}")
+    for key, stats in results.items():
+        line = f"{key:<32} {stats['median_us']:>11.1f} {stats['p90_us']:>11.1f}"
+        base = baseline.get(key)
+        if base is None:
+            print(f"{line} {'-':>11} {'new':>8}")
+            continue
+        change = stats["median_us"] / base["median_us"] - 1
+        mark = ""
+        if change > threshold:
+            regressions.append(key)
+            mark = "  REGRESSION"
+        print(f"{line} {base['median_us']:>11.1f} {change:>+8.1%}{mark}")
+    return regressions
+
+
+def parse_sizes(parser: argparse.ArgumentParser, sizes: list) -> list:
+    parsed = []
+    for size in sizes:
+        try:
+            width, height = (int(value) for value in size.lower().split("x"))
+        except ValueError:
+            parser.error(f"--sizes expects WxH, got {size!r}")
+        if not (64 <= width <= 1024 and 64 <= height <= 1024):
+            parser.error("--sizes supports maps from 64x64 to 1024x1024")
+        parsed.append((width, height))
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DOOM - Python Edition: engine microbenchmarks")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results file")
+    parser.add_argument("--save", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of the median before it counts as a regression (0.25 = 25%%)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--sizes", nargs="*", default=list(DEFAULT_SIZES),
+                        help="generated maps to run on besides the built-in levels (WxH)")
+    parser.add_argument("--no-builtin", action="store_true", help="skip the built-in levels")
+    parser.add_argument("--repeat", type=int, default=REPEATS, help="repeats per benchmark; the best median counts")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="render threads (default 1, so timings do not depend on the core count)")
+    args = parser.parse_args()
+
+    game_levels = []
+    if not args.no_builtin:
+        level_num = 1
+        while os.path.exists(os.path.join(BASE_DIR, "levels", f"level{level_num}.json")):
+            game_levels.append((f"level{level_num}", os.path.join(BASE_DIR, "levels", f"level{level_num}.json")))
+            level_num += 1
+    for width, height in parse_sizes(parser, args.sizes):
+        game_levels.append((f"{width}x{height}", generated_level_path(width, height, seed=0)))
+    if not game_levels:
+        parser.error("nothing to run: no built-in levels and no --sizes")
+
+    names = args.only or list(BENCHMARKS)
+    results = run(game_levels, names, args.workers, args.repeat)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("version") != BASELINE_VERSION:
+            print(f"{args.baseline}: unsupported baseline version, ignoring it", file=sys.stderr)
+            baseline = None
+
+    regressions = []
+    if baseline is not None:
+        if baseline["environment"] != environment():
+            print("warning: baseline was recorded in a different environment", file=sys.stderr)
+        regressions = compare(results, baseline["results"], args.threshold)
+    else:
+        compare(results, {}, args.threshold)
+
+    if args.save:
+        # Сохраняем поверх эталона только то, что замеряли в этот раз
+        stored = baseline["results"] if baseline is not None else {}
+        stored.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"version": BASELINE_VERSION, "environment": environment(), "results": stored}, f, indent=1)
+        print(f"baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
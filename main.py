@@ -1,9 +1,25 @@
+import time
+# Отсчёт для отчёта о времени запуска (--startup-report): до импорта pygame и NumPy
+STARTED = time.perf_counter()
+import os
+import queue
+import threading
 import pygame
 import numpy as np
 import math
+import argparse
+import csv
+import json
+import gzip
+import struct
+import hashlib
+import shutil
+from collections import deque, OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import List, Tuple, Optional
 import random
+IMPORTED = time.perf_counter()
 
 # Константы
 SCREEN_WIDTH = 1280
@@ -11,10 +27,55 @@ SCREEN_HEIGHT = 720
 FOV = math.pi / 3  # 60 градусов
 HALF_FOV = FOV / 2
 NUM_RAYS = 320
+RENDER_WORKERS = min(os.cpu_count() or 1, 8)  # Потоков рендеринга столбцов (1 — без пула)
+FLAT_DIVISOR = 2  # Пол и потолок считаются для каждого N-го столбца и строки (0 — без текстур)
 MAX_DEPTH = 20
 DELTA_ANGLE = FOV / NUM_RAYS
 SCALE = SCREEN_WIDTH // NUM_RAYS
 HALF_HEIGHT = SCREEN_HEIGHT // 2
+LIGHT_LEVELS = 32  # Уровней освещения в таблицах цветов
+LIGHT_DEPTH_STEPS = 16  # Шагов таблицы освещения на единицу расстояния
+MAX_FPS = 60  # Ограничение кадров в секунду (0 — без ограничения)
+IDLE_FPS = 20  # Частота цикла на статичных экранах (меню, пауза, итоги)
+BENCHMARK_FRAMES = 300  # Кадров на уровень в бенчмарке
+SIM_HZ = 60  # Частота шагов симуляции
+MAX_SIM_STEPS = 5  # Не больше шагов симуляции за кадр (защита от "спирали смерти")
+MOUSE_SENSITIVITY = 0.002
+PICKUP_RADIUS = 0.5  # Расстояние подбора предметов
+SHOT_RANGE = 15  # Дальность выстрела
+FLOW_FIELD_RADIUS = 32  # Радиус (в тайлах) поля путей врагов вокруг игрока
+# Кластер PVS — квадрат 2**N тайлов; при изменении параметров PVS повышаем LEVEL_CACHE_VERSION
+PVS_CLUSTER_SHIFT = 2
+PVS_ANGLES = 128  # Направлений лучей при расчёте PVS
+
+# Уровни и кэш скомпилированных уровней
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEVELS_DIR = os.path.join(BASE_DIR, "levels")
+LEVEL_CACHE_DIR = os.path.join(BASE_DIR, ".cache", "levels")
+LEVEL_CACHE_VERSION = 2  # Повышаем при изменении того, что кладётся в кэш
+GENERATED_LEVELS_DIR = os.path.join(BASE_DIR, ".cache", "generated")
+GENERATOR_VERSION = 2  # Повышаем при изменении алгоритма генерации или файла уровня (2: параметры в файле)
+ASSET_CACHE_DIR = os.path.join(BASE_DIR, ".cache", "assets")
+ASSET_CACHE_VERSION = 1  # Повышаем при изменении того, как строятся таблицы цветов или атласы шрифтов
+PROFILER_HISTORY = 120  # Кадров в скользящем среднем профайлера
+
+# Динамическое разрешение: ступени (лучей, делитель пола/потолка) от лучшей к худшей.
+# Число лучей должно делить SCREEN_WIDTH.
+RESOLUTION_STEPS = ((320, 2), (256, 2), (256, 4), (160, 4), (128, 4), (80, 8), (64, 8))
+RESOLUTION_WINDOW = 30  # Кадров, по которым усредняется время кадра
+RESOLUTION_COOLDOWN = 60  # Кадров после смены ступени до следующего решения
+RESOLUTION_DOWN = 1.1  # Понижаем, если среднее больше бюджета в столько раз
+RESOLUTION_UP = 0.7  # Повышаем, только если среднее меньше бюджета в столько раз
+TEXT_CACHE_SIZE = 256  # Сколько отрендеренных строк держать в кэше
+SPRITE_BASE_HEIGHT = 128  # Высота кадров в атласе спрайтов
+SPRITE_HEIGHT_STEP = 1.06  # Высоты масштабированных спрайтов квантуются с этим шагом
+SPRITE_CACHE_SIZE = 512  # Сколько масштабированных спрайтов держать в кэше
+ENEMY_ANIMATION_FRAMES = 4
+HUD_HEIGHT = 80
+HUD_BACKGROUND = (40, 40, 40, 200)
+MINIMAP_SCALE = 8  # Пикселей на тайл мини-карты
+MINIMAP_MAX_SIZE = (256, 192)  # Большие карты показываются окном вокруг игрока
+MINIMAP_MARGIN = 16  # Запас в тайлах вокруг окна при запекании больших карт
 
 # Цвета
 WHITE = (255, 255, 255)
@@ -57,6 +118,18 @@ class Vector2:
     def distance_to(self, other):
         return (self - other).length()
 
+    def lerp(self, other, t: float):
+        return Vector2(self.x + (other.x - self.x) * t, self.y + (other.y - self.y) * t)
+
+
+@dataclass
+class InputState:
+    """Ввод, действующий в течение одного шага симуляции"""
+    forward: int = 0
+    strafe: int = 0
+    turn: float = 0.0  # Смещение мыши по X
+    fire: bool = False
+
 
 class Weapon:
     def __init__(self):
@@ -86,46 +159,205 @@ class Weapon:
             self.is_firing = False
 
 
+class FlowField:
+    """Общее для всех врагов поле путей к игроку.
+
+    Поиск в ширину по сетке стен от тайла игрока (в окне FLOW_FIELD_RADIUS)
+    даёт расстояние до игрока для каждого достижимого тайла, а для каждого
+    тайла — центр соседнего тайла, который ближе к игроку. Поле
+    перестраивается только когда игрок переходит в другой тайл; враг же
+    просто берёт цель из своего тайла.
+    """
+
+    # Восемь соседей: сначала ортогональные, затем диагональные
+    NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+    def __init__(self, grid: np.ndarray, radius: int = FLOW_FIELD_RADIUS, moves: Optional[np.ndarray] = None):
+        self.grid = grid
+        self.radius = radius
+        # Маска допустимых шагов не зависит от игрока — её можно взять из кэша уровня
+        self.moves = self.compile_moves(grid) if moves is None else moves
+        self.root = None
+        self.origin = (0, 0)
+        self.distance = np.full((0, 0), -1, dtype=np.int32)
+        self.target_x = np.zeros((0, 0))
+        self.target_y = np.zeros((0, 0))
+
+    @classmethod
+    def compile_moves(cls, grid: np.ndarray) -> np.ndarray:
+        """Битовая маска допустимых шагов из каждого тайла: бит k — шаг к NEIGHBOURS[k].
+        По диагонали шагать можно, только если свободны оба ортогональных соседа."""
+        rows, cols = grid.shape
+        open_padded = np.zeros((rows + 2, cols + 2), dtype=bool)
+        open_padded[1:-1, 1:-1] = grid == 0
+        moves = np.zeros((rows, cols), dtype=np.uint8)
+        for bit, (dx, dy) in enumerate(cls.NEIGHBOURS):
+            passable = open_padded[1 + dy:rows + 1 + dy, 1 + dx:cols + 1 + dx]
+            if dx and dy:
+                passable = (passable & open_padded[1:rows + 1, 1 + dx:cols + 1 + dx] &
+                            open_padded[1 + dy:rows + 1 + dy, 1:cols + 1])
+            moves |= passable.astype(np.uint8) << bit
+        return moves
+
+    def update(self, x: float, y: float) -> bool:
+        """Перестраиваем поле, если игрок сменил тайл"""
+        root = (math.floor(x), math.floor(y))
+        if root == self.root:
+            return False
+        self.root = root
+        self.rebuild(*root)
+        return True
+
+    def rebuild(self, root_x: int, root_y: int):
+        height, width = self.grid.shape
+        x0, y0 = max(root_x - self.radius, 0), max(root_y - self.radius, 0)
+        x1, y1 = min(root_x + self.radius + 1, width), min(root_y + self.radius + 1, height)
+        self.origin = (x0, y0)
+
+        # Окно карты [y, x]; свободные тайлы
+        free = self.grid[y0:y1, x0:x1] == 0
+        distance = np.full(free.shape, -1, dtype=np.int32)
+        frontier = np.zeros(free.shape, dtype=bool)
+        if 0 <= root_y - y0 < free.shape[0] and 0 <= root_x - x0 < free.shape[1]:
+            frontier[root_y - y0, root_x - x0] = True
+            distance[frontier] = 0
+
+        # Волна BFS по четырём направлениям за раз
+        step = 0
+        while frontier.any():
+            step += 1
+            grown = np.zeros_like(frontier)
+            grown[1:] |= frontier[:-1]
+            grown[:-1] |= frontier[1:]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & free & (distance < 0)
+            distance[frontier] = step
+        self.distance = distance
+
+        # Для каждого тайла выбираем ближайшего к игроку соседа.
+        # По диагонали идём только если оба ортогональных соседа свободны.
+        rows, cols = free.shape
+        big = np.iinfo(np.int32).max
+        padded = np.full((rows + 2, cols + 2), big, dtype=np.int64)
+        padded[1:-1, 1:-1] = np.where(distance >= 0, distance, big)
+        moves = self.moves[y0:y1, x0:x1]
+
+        best = np.where(distance >= 0, distance, big).astype(np.int64)
+        best_dx = np.zeros(free.shape, dtype=np.int64)
+        best_dy = np.zeros(free.shape, dtype=np.int64)
+        for bit, (dx, dy) in enumerate(self.NEIGHBOURS):
+            neighbour = padded[1 + dy:rows + 1 + dy, 1 + dx:cols + 1 + dx]
+            if dx and dy:
+                neighbour = np.where(moves & (1 << bit), neighbour, big)
+            better = neighbour < best
+            best = np.where(better, neighbour, best)
+            best_dx = np.where(better, dx, best_dx)
+            best_dy = np.where(better, dy, best_dy)
+
+        xs = np.arange(x0, x1)[None, :]
+        ys = np.arange(y0, y1)[:, None]
+        self.target_x = xs + best_dx + 0.5
+        self.target_y = ys + best_dy + 0.5
+        # Тайлы без пути и сам тайл игрока отмечаем отсутствием цели
+        self.has_target = (distance > 0) & ((best_dx != 0) | (best_dy != 0))
+
+    def targets(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Точки, к которым надо идти из позиций (x, y), и маска найденных путей"""
+        if self.root is None:
+            return x, y, np.zeros(len(x), dtype=bool)
+        rows, cols = self.distance.shape
+        local_x = np.floor(x).astype(np.int64) - self.origin[0]
+        local_y = np.floor(y).astype(np.int64) - self.origin[1]
+        inside = (local_x >= 0) & (local_x < cols) & (local_y >= 0) & (local_y < rows)
+        local_x = np.clip(local_x, 0, cols - 1)
+        local_y = np.clip(local_y, 0, rows - 1)
+        found = inside & self.has_target[local_y, local_x]
+        return self.target_x[local_y, local_x], self.target_y[local_y, local_x], found
+
+
+# Параметры врагов по типу
+ENEMY_TYPES = {
+    "demon": {"health": 100, "speed": 1.5, "damage": 15, "color": RED, "size": 0.4},
+    "imp": {"health": 60, "speed": 2.0, "damage": 10, "color": BROWN, "size": 0.4},
+    "baron": {"health": 200, "speed": 1.0, "damage": 30, "color": DARK_RED, "size": 0.6},
+}
+ENEMY_DEFAULTS = {"health": 100, "speed": 1.5, "damage": 10, "color": RED, "size": 0.4}
+
+
+def _store_field(name: str, cast):
+    """Свойство Enemy, читающее и пишущее столбец name в EnemyManager"""
+
+    def getter(self):
+        return cast(getattr(self._store, name)[self._index])
+
+    def setter(self, value):
+        getattr(self._store, name)[self._index] = value
+
+    return property(getter, setter)
+
+
 class Enemy:
+    """Враг — лёгкое представление одной строки EnemyManager.
+
+    Все данные живут в массивах менеджера. Враги уровня создаются сразу в
+    общем менеджере (EnemyManager.spawn); созданный отдельно враг получает
+    собственный менеджер на одну запись, а EnemyManager.adopt переносит его
+    в общий.
+    """
+
+    health = _store_field("health", int)
+    max_health = _store_field("max_health", int)
+    speed = _store_field("speed", float)
+    damage = _store_field("damage", int)
+    attack_range = _store_field("attack_range", float)
+    attack_cooldown = _store_field("attack_cooldown", float)
+    last_attack = _store_field("last_attack", float)
+    is_alive = _store_field("alive", bool)
+    size = _store_field("size", float)
+    animation_frame = _store_field("animation_frame", int)
+    last_animation_time = _store_field("last_animation_time", float)
+
     def __init__(self, x: float, y: float, enemy_type: str = "demon"):
-        self.pos = Vector2(x, y)
-        self.health = 100
-        self.max_health = 100
-        self.speed = 1.5
-        self.damage = 10
-        self.attack_range = 1.0
-        self.attack_cooldown = 1.0
-        self.last_attack = 0
-        self.is_alive = True
         self.enemy_type = enemy_type
-        self.size = 0.4
-        self.animation_frame = 0
-        self.last_animation_time = 0
-
-        # Настройки по типу врага
-        if enemy_type == "demon":
-            self.health = 100
-            self.max_health = 100
-            self.speed = 1.5
-            self.damage = 15
-            self.color = RED
-        elif enemy_type == "imp":
-            self.health = 60
-            self.max_health = 60
-            self.speed = 2.0
-            self.damage = 10
-            self.color = BROWN
-        elif enemy_type == "baron":
-            self.health = 200
-            self.max_health = 200
-            self.speed = 1.0
-            self.damage = 30
-            self.color = DARK_RED
-            self.size = 0.6
+        self.color = ENEMY_TYPES.get(enemy_type, ENEMY_DEFAULTS)["color"]
+        self._store = EnemyManager()
+        self._index = self._store.append(self, x, y)
+
+    @classmethod
+    def bind(cls, store: "EnemyManager", index: int, enemy_type: str) -> "Enemy":
+        """Представление уже заполненной строки index хранилища store"""
+        enemy = cls.__new__(cls)
+        enemy.enemy_type = enemy_type
+        enemy.color = ENEMY_TYPES.get(enemy_type, ENEMY_DEFAULTS)["color"]
+        enemy._store, enemy._index = store, index
+        return enemy
+
+    @property
+    def pos(self) -> Vector2:
+        store, i = self._store, self._index
+        return Vector2(float(store.x[i]), float(store.y[i]))
+
+    @pos.setter
+    def pos(self, value: Vector2):
+        self._store.x[self._index] = value.x
+        self._store.y[self._index] = value.y
+
+    @property
+    def prev_pos(self) -> Vector2:
+        store, i = self._store, self._index
+        return Vector2(float(store.prev_x[i]), float(store.prev_y[i]))
+
+    @prev_pos.setter
+    def prev_pos(self, value: Vector2):
+        self._store.prev_x[self._index] = value.x
+        self._store.prev_y[self._index] = value.y
 
     def take_damage(self, damage: int):
         self.health -= damage
         if self.health <= 0:
+            if self.is_alive:
+                self._store.alive_count -= 1
             self.is_alive = False
             return True  # Враг убит
         return False
@@ -148,7 +380,7 @@ class Enemy:
 
         # Анимация
         if current_time - self.last_animation_time > 0.2:
-            self.animation_frame = (self.animation_frame + 1) % 4
+            self.animation_frame = (self.animation_frame + 1) % ENEMY_ANIMATION_FRAMES
             self.last_animation_time = current_time
 
     def check_wall_collision(self, new_pos: Vector2, walls: List) -> bool:
@@ -171,7 +403,174 @@ class Enemy:
         return self.damage
 
 
+class EnemyManager:
+    """Хранилище врагов в виде структуры массивов.
+
+    Позиции, здоровье, скорость, урон, перезарядка и тип хранятся в массивах
+    NumPy, поэтому движение, столкновения со стенами и проверка атаки
+    считаются сразу для всех врагов.
+    """
+
+    FIELDS = {
+        "x": np.float64, "y": np.float64, "prev_x": np.float64, "prev_y": np.float64,
+        "health": np.int32, "max_health": np.int32, "speed": np.float64, "damage": np.int32,
+        "attack_range": np.float64, "attack_cooldown": np.float64, "last_attack": np.float64,
+        "alive": np.bool_, "type_id": np.int8, "size": np.float64,
+        "animation_frame": np.int8, "last_animation_time": np.float64,
+    }
+    TYPE_NAMES = list(ENEMY_TYPES)
+
+    def __init__(self, enemies: List[Enemy] = (), capacity: int = 1):
+        self.count = 0
+        self.alive_count = 0  # Ведётся при добавлении и гибели врагов
+        self.capacity = max(capacity, len(enemies), 1)
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(self.capacity, dtype=dtype))
+        self.views = []
+        self.adopt(enemies)
+
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        self.capacity = max(needed, self.capacity * 2)
+        for name in self.FIELDS:
+            column = getattr(self, name)
+            grown = np.zeros(self.capacity, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            setattr(self, name, grown)
+
+    def append(self, view: Enemy, x: float, y: float) -> int:
+        """Добавляет запись для view со стартовыми параметрами её типа"""
+        self._grow(self.count + 1)
+        i = self.count
+        params = ENEMY_TYPES.get(view.enemy_type, ENEMY_DEFAULTS)
+        self.x[i] = self.prev_x[i] = x
+        self.y[i] = self.prev_y[i] = y
+        self.health[i] = self.max_health[i] = params["health"]
+        self.speed[i] = params["speed"]
+        self.damage[i] = params["damage"]
+        self.size[i] = params["size"]
+        self.attack_range[i] = 1.0
+        self.attack_cooldown[i] = 1.0
+        self.last_attack[i] = 0
+        self.alive[i] = True
+        self.type_id[i] = self.TYPE_NAMES.index(view.enemy_type) if view.enemy_type in ENEMY_TYPES else -1
+        self.animation_frame[i] = 0
+        self.last_animation_time[i] = 0
+        self.views.append(view)
+        self.count += 1
+        self.alive_count += 1
+        return i
+
+    def spawn(self, entries: List[Tuple[float, float, str]]) -> List[Enemy]:
+        """Добавляет врагов (x, y, тип) со стартовыми параметрами их типов — столбцами,
+        без отдельных хранилищ на врага; возвращает их представления"""
+        start, stop = self.count, self.count + len(entries)
+        self._grow(stop)
+        types = [enemy_type for _, _, enemy_type in entries]
+        # Индекс типа; -1 (неизвестный тип) берёт из таблиц последний элемент — ENEMY_DEFAULTS
+        type_id = np.array([self.TYPE_NAMES.index(t) if t in ENEMY_TYPES else -1 for t in types], dtype=np.int64)
+        for name in self.FIELDS:
+            getattr(self, name)[start:stop] = 0
+        rows = slice(start, stop)
+        self.x[rows] = self.prev_x[rows] = [x for x, _, _ in entries]
+        self.y[rows] = self.prev_y[rows] = [y for _, y, _ in entries]
+        for field, key in (("health", "health"), ("max_health", "health"), ("speed", "speed"),
+                           ("damage", "damage"), ("size", "size")):
+            table = np.array([ENEMY_TYPES[t][key] for t in self.TYPE_NAMES] + [ENEMY_DEFAULTS[key]])
+            getattr(self, field)[rows] = table[type_id]
+        self.attack_range[rows] = 1.0
+        self.attack_cooldown[rows] = 1.0
+        self.alive[rows] = True
+        self.type_id[rows] = type_id
+
+        views = [Enemy.bind(self, i, t) for i, t in zip(range(start, stop), types)]
+        self.views.extend(views)
+        self.count = stop
+        self.alive_count += len(entries)
+        return views
+
+    def adopt(self, enemies: List[Enemy]):
+        """Переносит врагов из их хранилищ в это, перепривязывая представления"""
+        self._grow(self.count + len(enemies))
+        for enemy in enemies:
+            source, j = enemy._store, enemy._index
+            i = self.count
+            for name in self.FIELDS:
+                getattr(self, name)[i] = getattr(source, name)[j]
+            if source.alive[j]:
+                self.alive_count += 1
+            enemy._store, enemy._index = self, i
+            self.views.append(enemy)
+            self.count += 1
+
+    def save_positions(self):
+        """Запоминаем позиции перед шагом симуляции (для интерполяции)"""
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+
+    def update(self, player_pos: Vector2, grid: np.ndarray, delta_time: float,
+               current_time: float, flow: Optional[FlowField] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Двигаем всех живых врагов к игроку.
+
+        С полем путей враг идёт к центру следующего тайла на пути к игроку;
+        без пути (или в тайле игрока) — прямо на игрока.
+        Возвращает индексы врагов, готовых атаковать (в порядке хранения), и
+        индексы врагов, перешедших в другой тайл.
+        """
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        alive = self.alive[:n]
+
+        # Движение к игроку
+        dx = player_pos.x - x
+        dy = player_pos.y - y
+        distance = np.sqrt(dx * dx + dy * dy)
+        moving = alive & (distance > self.attack_range[:n])
+
+        if flow is not None:
+            target_x, target_y, found = flow.targets(x, y)
+            dx = np.where(found, target_x - x, dx)
+            dy = np.where(found, target_y - y, dy)
+            heading = np.where(found, np.sqrt(dx * dx + dy * dy), distance)
+        else:
+            heading = distance
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = self.speed[:n] * delta_time
+            new_x = x + dx / heading * step
+            new_y = y + dy / heading * step
+
+        # Проверка коллизий со стенами
+        height, width = grid.shape
+        moving &= np.isfinite(new_x) & np.isfinite(new_y)
+        tile_x = np.where(moving, new_x, -1).astype(np.int64)
+        tile_y = np.where(moving, new_y, -1).astype(np.int64)
+        inside = (tile_x >= 0) & (tile_x < width) & (tile_y >= 0) & (tile_y < height)
+        blocked = inside & (grid[np.clip(tile_y, 0, height - 1), np.clip(tile_x, 0, width - 1)] > 0)
+        moving &= ~blocked
+        relocated = np.flatnonzero(moving & ((np.floor(new_x) != np.floor(x)) | (np.floor(new_y) != np.floor(y))))
+        x[moving] = new_x[moving]
+        y[moving] = new_y[moving]
+
+        # Анимация
+        animate = alive & (current_time - self.last_animation_time[:n] > 0.2)
+        self.animation_frame[:n][animate] = (self.animation_frame[:n][animate] + 1) % ENEMY_ANIMATION_FRAMES
+        self.last_animation_time[:n][animate] = current_time
+
+        # Кто может атаковать после перемещения
+        dx = player_pos.x - x
+        dy = player_pos.y - y
+        distance = np.sqrt(dx * dx + dy * dy)
+        ready = (alive & (distance <= self.attack_range[:n]) &
+                 (current_time - self.last_attack[:n] >= self.attack_cooldown[:n]))
+        return np.flatnonzero(ready), relocated
+
+
 class Pickup:
+    TYPES = ("health", "ammo", "armor")
+
     def __init__(self, x: float, y: float, pickup_type: str):
         self.pos = Vector2(x, y)
         self.pickup_type = pickup_type
@@ -189,10 +588,293 @@ class Pickup:
             self.color = BLUE
 
 
+class VisibilitySets:
+    """Потенциально видимые множества (PVS) кластеров тайлов.
+
+    Карта делится на кластеры 2**PVS_CLUSTER_SHIFT x 2**PVS_CLUSTER_SHIFT
+    тайлов. Для каждого кластера хранится битовое окно WIDTH x WIDTH
+    соседних кластеров с ним в центре. Таблица консервативна: если отрезок
+    длиной не больше RANGE из точки кластера не перекрыт стенами (по
+    RayCaster.segments_blocked), отмечены кластеры тайла его второго конца
+    и восьми соседних с ним тайлов. Таблица считается один раз и хранится
+    в кэше уровня, а в игре целые области карты отбрасываются проверкой бита.
+    """
+
+    SHIFT = PVS_CLUSTER_SHIFT
+    SIZE = 1 << SHIFT
+    # Дальность гарантии: радиус сбора спрайтов в render_sprites с запасом на полширины спрайта
+    RANGE = MAX_DEPTH + 2
+    # Конец такого отрезка и соседние с ним тайлы лежат не дальше RADIUS кластеров
+    RADIUS = (SIZE + RANGE) // SIZE
+    WIDTH = 2 * RADIUS + 1
+
+    def __init__(self, bits: np.ndarray):
+        # [кластер y, кластер x, упакованное окно]
+        self.bits = bits
+        self.rows, self.cols = bits.shape[:2]
+        self.source = None
+        self.visible = []
+
+    @classmethod
+    def compile(cls, grid: np.ndarray, angles: int = PVS_ANGLES, progress=None) -> np.ndarray:
+        """Упакованные окна видимости всех кластеров: uint8 [кластеры y, кластеры x, байты окна].
+
+        Из центра каждого кластера в angles направлениях идут «трубки»:
+        полосы вокруг луча шириной в полудиагональ кластера плюс угловой шаг
+        на длине RANGE. Любой видимый отрезок из кластера целиком лежит в
+        трубке ближайшего к нему направления, а его тайлы образуют монотонный
+        путь по свободным тайлам. Поэтому заливка свободных тайлов трубки
+        столбец за столбцом (с растеканием вдоль столбца) доходит до всех
+        видимых тайлов — и, возможно, до нескольких лишних. Центры всех
+        кластеров одинаково расположены относительно сетки, так что трубка
+        одного направления считается сразу для всех кластеров срезами карты
+        с шагом в кластер. progress(доля) вызывается после каждого направления.
+        """
+        size, radius, width = cls.SIZE, cls.RADIUS, cls.WIDTH
+        rows, cols = grid.shape
+        crows, ccols = -(-rows // size), -(-cols // size)
+        half_width = size / math.sqrt(2) + cls.RANGE * math.sin(math.pi / angles)
+        steps = size + cls.RANGE + 2
+
+        # Свободные тайлы с рамкой из стен, в которую трубки не выходят за края массива;
+        # phases[a][b][i, j] — тайл (i * size + a, j * size + b), чтобы срезы были непрерывными
+        pad = size * -(-(steps + math.ceil(half_width * math.sqrt(2)) + size + 2) // size)
+        free = np.zeros((crows * size + 2 * pad, ccols * size + 2 * pad), dtype=bool)
+        free[pad:pad + rows, pad:pad + cols] = grid == 0
+        phases = [[np.ascontiguousarray(free[a::size, b::size]) for b in range(size)] for a in range(size)]
+        phases_t = [[np.ascontiguousarray(free.T[a::size, b::size]) for b in range(size)] for a in range(size)]
+
+        # marks[окно y, окно x, кластер y, кластер x]; для направлений ближе к вертикали
+        # работаем с транспонированной картой через транспонированный вид
+        marks = np.zeros((width, width, crows, ccols), dtype=bool)
+        marks_t = marks.transpose(1, 0, 3, 2)
+        for k in range(angles):
+            angle = (k + 0.5) * 2 * math.pi / angles
+            dir_x, dir_y = math.cos(angle), math.sin(angle)
+            if abs(dir_x) >= abs(dir_y):
+                planes, target, major, minor = phases, marks, dir_x, dir_y
+            else:
+                planes, target, major, minor = phases_t, marks_t, dir_y, dir_x
+            plane_rows, plane_cols = target.shape[2:]
+            slope = minor / major
+            spread = half_width / abs(major)  # Полуширина трубки поперёк столбца
+
+            # reach[o] — достижимость тайла в строке o (от центра кластера) текущего столбца
+            reach = {}
+            for step in range(steps):
+                column = step if major > 0 else size - 1 - step
+                u = column - size // 2
+                v0, v1 = u * slope, (u + 1) * slope
+                lo = math.floor(min(v0, v1) - spread) - 1
+                hi = math.floor(max(v0, v1) + spread)
+
+                padded_column = pad + column
+                cells = []
+                for o in range(lo, hi + 1):
+                    padded_row = pad + size // 2 + o
+                    top, left = padded_row // size, padded_column // size
+                    open_ = planes[padded_row % size][padded_column % size][
+                        top:top + plane_rows, left:left + plane_cols]
+                    reached = reach.get(o)
+                    if step < size and 0 <= size // 2 + o < size:
+                        reached = open_  # Свободные тайлы самого кластера — начало путей
+                    elif reached is not None:
+                        reached = reached & open_
+                    cells.append([reached, open_])
+                # Растекание вдоль столбца по свободным тайлам: вниз и вверх
+                for order in (cells, cells[::-1]):
+                    previous = None
+                    for cell in order:
+                        if previous is not None:
+                            spilled = previous & cell[1]
+                            cell[0] = spilled if cell[0] is None else cell[0] | spilled
+                        previous = cell[0]
+                reach = {o: cell[0] for o, cell in zip(range(lo, hi + 1), cells) if cell[0] is not None}
+
+                # Отмечаем кластеры достигнутых тайлов и их соседей по восьми направлениям:
+                # спрайт виден частично, даже когда его центр за углом
+                merged = {}
+                for o, reached in reach.items():
+                    for offset_y in {(size // 2 + o + d) >> cls.SHIFT for d in (-1, 0, 1)}:
+                        if -radius <= offset_y <= radius:
+                            merged[offset_y] = reached if offset_y not in merged else merged[offset_y] | reached
+                for offset_x in {(column + d) >> cls.SHIFT for d in (-1, 0, 1)}:
+                    if -radius <= offset_x <= radius:
+                        for offset_y, reached in merged.items():
+                            target[radius + offset_y, radius + offset_x] |= reached
+                if step >= size and not any(reached.any() for reached in reach.values()):
+                    break
+            if progress is not None:
+                progress((k + 1) / angles)
+
+        marks[radius, radius] = True
+        return np.packbits(marks.transpose(2, 3, 0, 1).reshape(crows, ccols, width * width), axis=-1)
+
+    def clusters(self, x: float, y: float) -> List[Tuple[int, int, int, int]]:
+        """Тайловые прямоугольники (x0, y0, x1, y1 включительно) кластеров, потенциально
+        видимых из точки (x, y)"""
+        source = (math.floor(x) >> self.SHIFT, math.floor(y) >> self.SHIFT)
+        if source != self.source:
+            # Окно распаковываем, только когда точка переходит в другой кластер
+            cx, cy = source
+            self.visible = []
+            if 0 <= cx < self.cols and 0 <= cy < self.rows:
+                window = np.unpackbits(self.bits[cy, cx], count=self.WIDTH * self.WIDTH)
+                oy, ox = np.divmod(np.flatnonzero(window), self.WIDTH)
+                size = self.SIZE
+                for tile_x, tile_y in zip(((ox + cx - self.RADIUS) * size).tolist(),
+                                          ((oy + cy - self.RADIUS) * size).tolist()):
+                    self.visible.append((tile_x, tile_y, tile_x + size - 1, tile_y + size - 1))
+            self.source = source
+        return self.visible
+
+    def regions(self, x: float, y: float, tx0: int, ty0: int, tx1: int, ty1: int) -> List[Tuple[int, int, int, int]]:
+        """Части прямоугольника тайлов [tx0, tx1] x [ty0, ty1] (включительно), потенциально
+        видимые из точки (x, y): по прямоугольнику на кластер"""
+        found = []
+        for x0, y0, x1, y1 in self.clusters(x, y):
+            if x0 < tx0:
+                x0 = tx0
+            if y0 < ty0:
+                y0 = ty0
+            if x1 > tx1:
+                x1 = tx1
+            if y1 > ty1:
+                y1 = ty1
+            if x0 <= x1 and y0 <= y1:
+                found.append((x0, y0, x1, y1))
+        return found
+
+
+class SpatialGrid:
+    """Равномерная пространственная сетка, выровненная по тайлам карты.
+
+    Каждая ячейка хранит множество объектов (врагов или предметов), центр
+    которых лежит в ней. Запросы обходят только ячейки, пересекающие
+    область запроса, и проверяют точную позицию объекта через его pos.
+    С таблицей VisibilitySets обходятся только ячейки кластеров, видимых из
+    центра запроса.
+    """
+
+    def __init__(self, cell_size: float = 1.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.item_cells = {}
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def insert(self, item, x: float, y: float):
+        cell = self.cell_of(x, y)
+        self.cells.setdefault(cell, set()).add(item)
+        self.item_cells[item] = cell
+
+    def remove(self, item):
+        cell = self.item_cells.pop(item, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            bucket.discard(item)
+            if not bucket:
+                del self.cells[cell]
+
+    def move(self, item, x: float, y: float):
+        """Обновляем ячейку объекта после перемещения"""
+        cell = self.cell_of(x, y)
+        old_cell = self.item_cells.get(item)
+        if cell != old_cell:
+            if old_cell is not None:
+                self.remove(item)
+            self.cells.setdefault(cell, set()).add(item)
+            self.item_cells[item] = cell
+
+    def query_tile(self, tile_x: int, tile_y: int) -> List:
+        """Объекты в ячейке тайла"""
+        return list(self.cells.get(self.cell_of(tile_x, tile_y), ()))
+
+    def query_rect(self, x0: float, y0: float, x1: float, y1: float) -> List:
+        """Объекты в прямоугольнике [x0, x1) x [y0, y1)"""
+        found = []
+        cx0, cy0 = self.cell_of(x0, y0)
+        cx1, cy1 = self.cell_of(x1, y1)
+        cells = self.cells
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    for item in bucket:
+                        pos = item.pos
+                        if x0 <= pos.x < x1 and y0 <= pos.y < y1:
+                            found.append(item)
+        return found
+
+    def _scan(self, cx0: int, cy0: int, cx1: int, cy1: int, accept,
+              visible: Optional[VisibilitySets] = None, origin: Tuple[float, float] = (0.0, 0.0)) -> List:
+        found = []
+        cells = self.cells
+        # С PVS обходим только видимые из origin части прямоугольника (ячейки совпадают с тайлами)
+        rects = [(cx0, cy0, cx1, cy1)] if visible is None else visible.regions(*origin, cx0, cy0, cx1, cy1)
+        area = sum((rx1 - rx0 + 1) * (ry1 - ry0 + 1) for rx0, ry0, rx1, ry1 in rects)
+        if len(cells) * len(rects) < area:
+            # Занятых ячеек меньше, чем ячеек запроса: дешевле перебрать занятые
+            for (cx, cy), bucket in cells.items():
+                for rx0, ry0, rx1, ry1 in rects:
+                    if rx0 <= cx <= rx1 and ry0 <= cy <= ry1:
+                        found.extend(item for item in bucket if accept(item.pos))
+                        break
+            return found
+        for rx0, ry0, rx1, ry1 in rects:
+            for cy in range(ry0, ry1 + 1):
+                for cx in range(rx0, rx1 + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket:
+                        found.extend(item for item in bucket if accept(item.pos))
+        return found
+
+    def query_radius(self, x: float, y: float, radius: float, visible: Optional[VisibilitySets] = None) -> List:
+        """Объекты на расстоянии не больше radius от (x, y); с visible — только в видимых из (x, y) кластерах"""
+        cx0, cy0 = self.cell_of(x - radius, y - radius)
+        cx1, cy1 = self.cell_of(x + radius, y + radius)
+        radius_sq = radius * radius
+        return self._scan(cx0, cy0, cx1, cy1,
+                          lambda pos: (pos.x - x) ** 2 + (pos.y - y) ** 2 <= radius_sq, visible, (x, y))
+
+    def query_cone(self, x: float, y: float, angle: float, half_angle: float, radius: float,
+                   visible: Optional[VisibilitySets] = None) -> List:
+        """Объекты в секторе радиуса radius с осью angle и полушириной half_angle;
+        с visible — только в видимых из (x, y) кластерах"""
+        # Ограничивающий прямоугольник сектора: вершина, края дуги и те
+        # крайние точки окружности, что попадают внутрь сектора
+        xs = [x, x + radius * math.cos(angle - half_angle), x + radius * math.cos(angle + half_angle)]
+        ys = [y, y + radius * math.sin(angle - half_angle), y + radius * math.sin(angle + half_angle)]
+        for extreme in (0.0, math.pi / 2, math.pi, 3 * math.pi / 2):
+            if abs((extreme - angle + math.pi) % (2 * math.pi) - math.pi) <= half_angle:
+                xs.append(x + radius * math.cos(extreme))
+                ys.append(y + radius * math.sin(extreme))
+        cx0, cy0 = self.cell_of(min(xs), min(ys))
+        cx1, cy1 = self.cell_of(max(xs), max(ys))
+
+        radius_sq = radius * radius
+
+        def accept(pos):
+            dx = pos.x - x
+            dy = pos.y - y
+            if dx * dx + dy * dy > radius_sq:
+                return False
+            return abs((math.atan2(dy, dx) - angle + math.pi) % (2 * math.pi) - math.pi) <= half_angle
+
+        return self._scan(cx0, cy0, cx1, cy1, accept, visible, (x, y))
+
+
 class Player:
     def __init__(self, x: float, y: float):
         self.pos = Vector2(x, y)
         self.angle = 0
+        # Поза на предыдущем шаге симуляции — для интерполяции при рендеринге
+        self.prev_pos = Vector2(x, y)
+        self.prev_angle = 0
         self.health = 100
         self.max_health = 100
         self.armor = 0
@@ -202,6 +884,7 @@ class Player:
         self.weapon = Weapon()
         self.score = 0
         self.kills = 0
+        self.god_mode = False  # Неуязвимость (для бенчмарка)
 
     def move(self, forward: float, strafe: float, walls: List, delta_time: float):
         # Вычисляем направление движения
@@ -239,12 +922,25 @@ class Player:
                         return True
         return False
 
+    def save_pose(self):
+        self.prev_pos = Vector2(self.pos.x, self.pos.y)
+        self.prev_angle = self.angle
+
+    def view_pose(self, alpha: float) -> Tuple[float, float, float]:
+        """Поза между предыдущим и текущим шагом симуляции"""
+        pos = self.prev_pos.lerp(self.pos, alpha)
+        turn = (self.angle - self.prev_angle + math.pi) % (2 * math.pi) - math.pi
+        return pos.x, pos.y, (self.prev_angle + turn * alpha) % (2 * math.pi)
+
     def rotate(self, angle_delta: float, delta_time: float):
         self.angle += angle_delta * self.rotation_speed * delta_time
         # Нормализуем угол
         self.angle = self.angle % (2 * math.pi)
 
     def take_damage(self, damage: int):
+        if self.god_mode:
+            return False
+
         # Сначала поглощаем урон бронёй
         if self.armor > 0:
             armor_absorbed = min(self.armor, damage // 2)
@@ -266,32 +962,1711 @@ class Player:
         self.weapon.ammo = min(self.weapon.ammo + amount, self.weapon.max_ammo)
 
 
-class DoomGame:
+class RayCaster:
+    """Пакетный DDA-рейкастер: все лучи кадра за несколько проходов NumPy.
+
+    Повторяет логику DoomGame.cast_ray шаг в шаг (те же накопления
+    координат, та же проверка границ), поэтому результаты совпадают с ним.
+    """
+
+    def __init__(self, walls):
+        self.grid = np.asarray(walls, dtype=np.int32)
+        self.height, self.width = self.grid.shape
+
+    @staticmethod
+    def ray_fan(player_angle: float, num_rays: int = NUM_RAYS) -> np.ndarray:
+        """Углы лучей слева направо, как их накапливает render_3d"""
+        steps = np.full(num_rays, FOV / num_rays)
+        steps[0] = player_angle - HALF_FOV
+        return np.cumsum(steps)
+
+    def _walk(self, start: np.ndarray, step: np.ndarray, depth0: np.ndarray,
+              delta_depth: np.ndarray, other0: np.ndarray, other_step: np.ndarray,
+              vertical: bool):
+        """Проходит MAX_DEPTH пересечений с линиями сетки одной ориентации"""
+        num = len(start)
+        # Накапливаем суммы через cumsum, чтобы ошибки округления были как в цикле
+        along = np.empty((num, MAX_DEPTH + 1))
+        along[:, 0] = start
+        along[:, 1:] = step[:, None]
+        along = np.cumsum(along, axis=1)
+
+        across = np.empty((num, MAX_DEPTH + 1))
+        across[:, 0] = other0
+        across[:, 1:] = other_step[:, None]
+        across = np.cumsum(across, axis=1)
+
+        depth = np.empty((num, MAX_DEPTH))
+        depth[:, 0] = depth0
+        depth[:, 1:] = delta_depth[:, None]
+        depth = np.cumsum(depth, axis=1)
+
+        xs, ys = (along, across) if vertical else (across, along)
+        xs = xs[:, :MAX_DEPTH]
+        ys = ys[:, :MAX_DEPTH]
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        tile_x = np.where(finite, xs, -1).astype(np.int64)
+        tile_y = np.where(finite, ys, -1).astype(np.int64)
+
+        inside = finite & (tile_x >= 0) & (tile_x < self.width) & (tile_y >= 0) & (tile_y < self.height)
+        cells = self.grid[np.clip(tile_y, 0, self.height - 1), np.clip(tile_x, 0, self.width - 1)]
+        hits = inside & (cells > 0)
+
+        has_hit = hits.any(axis=1)
+        first = hits.argmax(axis=1)
+        rows = np.arange(num)
+
+        hit_depth = np.where(has_hit, depth[rows, first], MAX_DEPTH)
+        texture = np.where(has_hit, cells[rows, first], 0)
+        # Без попадания цикл успевает сделать все MAX_DEPTH шагов
+        last = np.where(has_hit, first, MAX_DEPTH)
+        return hit_depth, texture, across[rows, last]
+
+    def cast(self, px: float, py: float, angles: np.ndarray):
+        """Бросает пачку лучей из (px, py).
+
+        Возвращает массивы (расстояние, тип стены, горизонтальная ли стена,
+        позиция текстуры) — по элементу на луч.
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        sin_a = np.sin(angles)
+        cos_a = np.cos(angles)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Горизонтальные пересечения
+            down = sin_a > 0
+            y_hor = np.where(down, int(py) + 1, int(py) - 1e-6)
+            dy = np.where(down, 1.0, -1.0)
+            depth_hor0 = (y_hor - py) / sin_a
+            x_hor0 = px + depth_hor0 * cos_a
+            delta_hor = dy / sin_a
+            depth_hor, texture_hor, x_hor = self._walk(
+                y_hor, dy, depth_hor0, np.abs(delta_hor), x_hor0, delta_hor * cos_a, vertical=False)
+
+            # Вертикальные пересечения
+            right = cos_a > 0
+            x_vert = np.where(right, int(px) + 1, int(px) - 1e-6)
+            dx = np.where(right, 1.0, -1.0)
+            depth_vert0 = (x_vert - px) / cos_a
+            y_vert0 = py + depth_vert0 * sin_a
+            delta_vert = dx / cos_a
+            depth_vert, texture_vert, y_vert = self._walk(
+                x_vert, dx, depth_vert0, np.abs(delta_vert), y_vert0, delta_vert * sin_a, vertical=True)
+
+        # Лучи, параллельные линиям сетки, не пересекают их вовсе
+        no_hor = sin_a == 0
+        depth_hor[no_hor] = MAX_DEPTH
+        texture_hor[no_hor] = 0
+        x_hor[no_hor] = 0
+        no_vert = cos_a == 0
+        depth_vert[no_vert] = MAX_DEPTH
+        texture_vert[no_vert] = 0
+        y_vert[no_vert] = 0
+
+        # Выбираем ближайшее пересечение
+        horizontal = ~(depth_vert < depth_hor)
+        depth = np.where(horizontal, depth_hor, depth_vert)
+        wall_type = np.where(horizontal, texture_hor, texture_vert)
+        y_frac = np.mod(y_vert, 1)
+        x_frac = np.mod(x_hor, 1)
+        offset = np.where(horizontal,
+                          np.where(sin_a < 0, x_frac, 1 - x_frac),
+                          np.where(cos_a > 0, y_frac, 1 - y_frac))
+        return depth, wall_type, horizontal, offset
+
+    def is_solid(self, tile_x: int, tile_y: int) -> bool:
+        return 0 <= tile_x < self.width and 0 <= tile_y < self.height and self.grid[tile_y, tile_x] > 0
+
+    def segment_blocked(self, x0: float, y0: float, x1: float, y1: float) -> bool:
+        """Точная проверка видимости: обходим все тайлы, которые пересекает отрезок.
+
+        Если отрезок проходит ровно через угол тайлов, проверяются оба
+        соседних тайла, так что сквозь стыки стен луч не проскальзывает.
+        """
+        tile_x, tile_y = math.floor(x0), math.floor(y0)
+        end_x, end_y = math.floor(x1), math.floor(y1)
+        if self.is_solid(tile_x, tile_y):
+            return True
+
+        dx = x1 - x0
+        dy = y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        delta_x = abs(1 / dx) if dx != 0 else math.inf
+        delta_y = abs(1 / dy) if dy != 0 else math.inf
+        t_max_x = ((tile_x + 1 - x0) if dx > 0 else (x0 - tile_x)) * delta_x if dx != 0 else math.inf
+        t_max_y = ((tile_y + 1 - y0) if dy > 0 else (y0 - tile_y)) * delta_y if dy != 0 else math.inf
+
+        remaining = abs(end_x - tile_x) + abs(end_y - tile_y)
+        while remaining > 0:
+            if t_max_x < t_max_y:
+                tile_x += step_x
+                t_max_x += delta_x
+                remaining -= 1
+            elif t_max_y < t_max_x:
+                tile_y += step_y
+                t_max_y += delta_y
+                remaining -= 1
+            else:
+                # Проходим через угол: соседи по диагонали тоже перекрывают обзор
+                if self.is_solid(tile_x + step_x, tile_y) or self.is_solid(tile_x, tile_y + step_y):
+                    return True
+                tile_x += step_x
+                tile_y += step_y
+                t_max_x += delta_x
+                t_max_y += delta_y
+                remaining -= 2
+
+            if self.is_solid(tile_x, tile_y):
+                return True
+        return False
+
+    def _solid(self, tile_x: np.ndarray, tile_y: np.ndarray) -> np.ndarray:
+        inside = (tile_x >= 0) & (tile_x < self.width) & (tile_y >= 0) & (tile_y < self.height)
+        cells = self.grid[np.clip(tile_y, 0, self.height - 1), np.clip(tile_x, 0, self.width - 1)]
+        return inside & (cells > 0)
+
+    def segments_blocked(self, x0, y0, x1, y1) -> np.ndarray:
+        """Пакетная версия segment_blocked: все отрезки обходятся одновременно"""
+        x0, y0, x1, y1 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (x0, y0, x1, y1)))
+        tile_x = np.floor(x0).astype(np.int64)
+        tile_y = np.floor(y0).astype(np.int64)
+        remaining = (np.abs(np.floor(x1).astype(np.int64) - tile_x) +
+                     np.abs(np.floor(y1).astype(np.int64) - tile_y))
+
+        dx = x1 - x0
+        dy = y1 - y0
+        step_x = np.where(dx > 0, 1, -1)
+        step_y = np.where(dy > 0, 1, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta_x = np.where(dx != 0, np.abs(1 / dx), np.inf)
+            delta_y = np.where(dy != 0, np.abs(1 / dy), np.inf)
+            t_max_x = np.where(dx != 0, np.where(dx > 0, tile_x + 1 - x0, x0 - tile_x) * delta_x, np.inf)
+            t_max_y = np.where(dy != 0, np.where(dy > 0, tile_y + 1 - y0, y0 - tile_y) * delta_y, np.inf)
+
+        blocked = self._solid(tile_x, tile_y)
+        while True:
+            active = (remaining > 0) & ~blocked
+            if not active.any():
+                return blocked
+
+            corner = active & (t_max_x == t_max_y)
+            blocked |= corner & (self._solid(tile_x + step_x, tile_y) | self._solid(tile_x, tile_y + step_y))
+            move_x = active & ((t_max_x < t_max_y) | corner)
+            move_y = active & ((t_max_y < t_max_x) | corner)
+
+            tile_x += np.where(move_x, step_x, 0)
+            tile_y += np.where(move_y, step_y, 0)
+            t_max_x = np.where(move_x, t_max_x + delta_x, t_max_x)
+            t_max_y = np.where(move_y, t_max_y + delta_y, t_max_y)
+            remaining -= move_x.astype(np.int64) + move_y.astype(np.int64)
+            blocked |= active & self._solid(tile_x, tile_y)
+
+
+class AssetCache:
+    """Кэш сгенерированных ассетов на диске: наборы массивов .npy.
+
+    Ключ — любые JSON-сериализуемые параметры, от которых зависит результат;
+    вместе с ASSET_CACHE_VERSION он хэшируется в имя каталога ассета. Массивы
+    читаются через mmap, как у уровней; если каталога нет, массивы строятся
+    заново и каталог появляется атомарно, уже заполненным.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def get(self, name: str, key, compute) -> dict:
+        """Массивы ассета name: из кэша или compute() -> {имя: массив} с записью в кэш"""
+        path = None
+        if self.cache_dir:
+            digest = hashlib.sha256(json.dumps([ASSET_CACHE_VERSION, key]).encode()).hexdigest()[:16]
+            path = os.path.join(self.cache_dir, f"{name}-{digest}")
+            if os.path.isdir(path):
+                try:
+                    # Обычные массивы поверх mmap: у np.memmap заметные накладные расходы на каждый срез
+                    return {os.path.splitext(file_name)[0]:
+                            np.asarray(np.load(os.path.join(path, file_name), mmap_mode="r"))
+                            for file_name in os.listdir(path)}
+                except (OSError, ValueError):
+                    pass
+
+        arrays = compute()
+        if path:
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            try:
+                os.makedirs(tmp_path, exist_ok=True)
+                for array_name, array in arrays.items():
+                    np.save(os.path.join(tmp_path, f"{array_name}.npy"), array)
+                os.replace(tmp_path, path)
+            except OSError:
+                # Параллельный запуск успел записать тот же ассет — оставляем его
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return arrays
+
+
+class ColorMaps:
+    """Таблицы освещения в стиле DOOM.
+
+    При создании текстур для каждой из них заранее считаются LIGHT_LEVELS
+    затемнённых копий (отдельный набор — для горизонтальных стен), уже в
+    формате пикселей экрана. Во время кадра остаётся только выбрать уровень
+    по расстоянию и взять готовый тексель. С кэшем ассетов таблицы читаются
+    с диска по хэшу текстур и формату пикселей. Стены без текстуры
+    затеняются отдельно, по формуле исходного рендера (untextured_pixels).
+    """
+
+    # Цвет стен без текстуры (заглушка в таблицах; на экран идёт untextured_pixels)
+    UNTEXTURED_COLOR = (200, 100, 100)
+
+    def __init__(self, textures: dict, surface: pygame.Surface, levels: int = LIGHT_LEVELS,
+                 flats: Optional[dict] = None, cache: Optional[AssetCache] = None):
+        self.surface = surface
+        self.levels = levels
+        self.texture_size = next(iter(textures.values())).get_width()
+        size = self.texture_size
+
+        # Стопка текстур [тип, x, y, rgb]; нулевой слот — стена без текстуры
+        stack = np.empty((max(textures) + 1, size, size, 3), dtype=np.uint8)
+        stack[:] = self.UNTEXTURED_COLOR
+        for wall_type, texture in textures.items():
+            stack[wall_type] = pygame.surfarray.array3d(texture)
+        self.num_textures = len(stack)
+        self.textured = np.zeros(self.num_textures, dtype=bool)
+        self.textured[list(textures)] = True
+        # Пиксели цветов (v, v // 2, v // 2) стен без текстуры для каждой яркости v
+        values = np.arange(256)
+        plain = np.stack([values, values // 2, values // 2], axis=-1)[None].astype(np.uint8)
+        self.untextured = pygame.surfarray.map_array(surface, plain)[0].astype(np.uint32)
+
+        # Текстуры пола и потолка: [имя -> индекс], [индекс, x, y, rgb]
+        flats = flats or {}
+        self.flat_index = {name: i for i, name in enumerate(flats)}
+        flat_stack = np.empty((len(flats), size, size, 3), dtype=np.uint8)
+        for i, texture in enumerate(flats.values()):
+            flat_stack[i] = pygame.surfarray.array3d(texture)
+
+        # Уровень света k соответствует яркости k / (levels - 1)
+        brightness = np.arange(levels) / (levels - 1)
+
+        def build():
+            # [ориентация, уровень, тип, x, y]; ориентация 1 — горизонтальная стена
+            walls = np.empty((2, levels) + stack.shape[:3], dtype=np.uint32)
+            for side, side_light in enumerate((1.0, 0.8)):
+                for level in range(levels):
+                    shaded = (stack * (brightness[level] * side_light)).astype(np.uint8)
+                    walls[side, level] = pygame.surfarray.map_array(surface, shaded)
+            # [индекс, уровень, x, y]
+            flat_tables = np.empty((len(flat_stack), levels, size, size), dtype=np.uint32)
+            for i, flat in enumerate(flat_stack):
+                for level in range(levels):
+                    flat_tables[i, level] = pygame.surfarray.map_array(surface, (flat * brightness[level]).astype(np.uint8))
+            return {"walls": walls, "flats": flat_tables}
+
+        if cache is None:
+            tables = build()
+        else:
+            digest = hashlib.sha256(stack.tobytes() + flat_stack.tobytes()).hexdigest()
+            key = [digest, levels, surface.get_bitsize(), surface.get_masks()]
+            tables = cache.get("colormaps", key, build)
+        self.walls = tables["walls"]
+        self.flats = tables["flats"]
+
+        # Уровень света по расстоянию с шагом 1 / LIGHT_DEPTH_STEPS
+        depths = np.arange(MAX_DEPTH * LIGHT_DEPTH_STEPS + 1) / LIGHT_DEPTH_STEPS
+        self.wall_light = np.rint((levels - 1) / (1 + depths * depths * 0.1)).astype(np.intp)
+        sprite_brightness = np.clip(1 - depths / MAX_DEPTH, 0.3, 1.0)
+        self.sprite_light = np.rint(sprite_brightness * (levels - 1)).astype(np.intp).tolist()
+        self.brightness = brightness.tolist()
+
+    def depth_bucket(self, depth):
+        """Индекс в таблицах освещения для расстояния (скаляр или массив)"""
+        return np.minimum(np.asarray(depth) * LIGHT_DEPTH_STEPS, MAX_DEPTH * LIGHT_DEPTH_STEPS).astype(np.intp)
+
+    def untextured_pixels(self, depths: np.ndarray, horizontal: np.ndarray) -> np.ndarray:
+        """Пиксели стен без текстуры: яркость по расстоянию, как в исходном render_3d"""
+        values = np.clip((200 / (1 + depths * 0.1)).astype(np.int64), 50, 200)
+        values = np.where(horizontal, (values * 0.8).astype(np.int64), values)
+        return self.untextured[values]
+
+    def wall_levels(self, depths: np.ndarray) -> np.ndarray:
+        """Уровни света для столбцов стен"""
+        return self.wall_light[self.depth_bucket(depths)]
+
+    def sprite_level(self, distance: float) -> int:
+        """Уровень света спрайта на заданном расстоянии"""
+        return self.sprite_light[min(int(distance * LIGHT_DEPTH_STEPS), MAX_DEPTH * LIGHT_DEPTH_STEPS)]
+
+
+class FlatRenderer:
+    """Текстурированные пол и потолок (floor casting) на NumPy.
+
+    Камера на половине высоты стены, поэтому у строки k под горизонтом
+    (и зеркальной ей строки потолка) расстояние до пола одно на весь экран:
+    (H / 2) / (k + 0.5). Точка пола в столбце — позиция игрока плюс луч
+    столбца длиной расстояние / cos(угол луча к взгляду). Считаем это
+    бродкастингом сразу для всех строк и столбцов полосы; с divisor > 1 —
+    только для каждого divisor-го столбца и строки, растягивая результат.
+    """
+
+    def __init__(self, colormaps: ColorMaps, height: int, divisor: int = FLAT_DIVISOR):
+        self.colormaps = colormaps
+        self.height = height
+        self.divisor = divisor
+        self.floor = colormaps.flat_index["floor"]
+        self.ceiling = colormaps.flat_index["ceiling"]
+
+        # Расстояния и уровни света по строкам от горизонта вниз (центры блоков по divisor строк)
+        half = height // 2
+        rows = np.arange(0, half, divisor) + divisor / 2
+        self.distances = (half / rows)[None, :]
+        # Смещение уровня света в плоской таблице [уровень, x, y]
+        self.level_offsets = (colormaps.wall_levels(self.distances) * colormaps.texture_size ** 2).astype(np.int32)
+
+    def render(self, view_x: float, view_y: float, view_angle: float, ray_angles: np.ndarray,
+               first: int, count: int) -> np.ndarray:
+        """Пиксели пола и потолка для лучей first..first+count: [луч, строка экрана]"""
+        divisor = self.divisor
+        size = self.colormaps.texture_size
+
+        # Сетка выборки общая для всего кадра, а не для полосы — иначе кадр
+        # зависел бы от разбиения на полосы
+        start = first - first % divisor
+        sampled = ray_angles[start:first + count:divisor][:, None]
+        # float32/int32 и маска вместо остатка: размер текстуры — степень двойки
+        scale = (self.distances / np.cos(sampled - view_angle)).astype(np.float32)
+        tex_x = ((np.float32(view_x) + np.cos(sampled).astype(np.float32) * scale) * size).astype(np.int32)
+        tex_y = ((np.float32(view_y) + np.sin(sampled).astype(np.float32) * scale) * size).astype(np.int32)
+        texels = self.level_offsets + (tex_x & (size - 1)) * size + (tex_y & (size - 1))
+
+        flats = self.colormaps.flats
+        rows = texels.shape[1]
+        planes = np.empty((texels.shape[0], 2 * rows), dtype=np.uint32)
+        flats[self.ceiling].reshape(-1).take(texels[:, ::-1], out=planes[:, :rows])
+        flats[self.floor].reshape(-1).take(texels, out=planes[:, rows:])
+        if divisor > 1:
+            # Растягиваем выборку одним копированием; у потолка блоки строк
+            # считаем от горизонта вверх
+            columns = planes.shape[0]
+            planes = np.broadcast_to(planes[:, None, :, None], (columns, divisor, 2 * rows, divisor))
+            planes = planes.reshape(columns * divisor, 2 * rows * divisor)
+            half, ceiling_rows = self.height // 2, rows * divisor
+            planes = planes[first - start:first - start + count, ceiling_rows - half:ceiling_rows + half]
+        return planes
+
+
+class WallRenderer:
+    """Рисует стены прямо в кадровый буфер NumPy и выводит его одним blit"""
+
+    def __init__(self, colormaps: ColorMaps, surface: pygame.Surface):
+        self.colormaps = colormaps
+        self.surface = surface
+        self.width, self.height = surface.get_size()
+        self.texture_size = colormaps.texture_size
+
+        # Буфер хранит пиксели уже в формате поверхности экрана
+        self.frame = np.empty((self.width, self.height), dtype=np.uint32)
+
+        self.ceiling_pixel = surface.map_rgb(CEILING_COLOR)
+        self.floor_pixel = surface.map_rgb(FLOOR_COLOR)
+        self.rows = np.arange(self.height, dtype=np.float32)
+        # Столбец без стены: потолок над серединой экрана, пол под ней
+        self.background = np.where(self.rows < self.height // 2, self.ceiling_pixel,
+                                   self.floor_pixel).astype(np.uint32)
+
+    def render(self, depths: np.ndarray, wall_types: np.ndarray,
+               horizontal: np.ndarray, offsets: np.ndarray, first: int = 0, total: Optional[int] = None,
+               flats: Optional[np.ndarray] = None):
+        """Заполняет кадровый буфер: по столбцу текстуры на каждый луч.
+
+        Можно рисовать полосу кадра: лучи first..first+len(depths) из total.
+        flats — пиксели пола и потолка [луч, строка]; без них они заливаются цветом.
+        """
+        num_rays = len(depths)
+        scale = self.width // (total or num_rays)
+        height = self.height
+        size = self.texture_size
+
+        # Высота стены и её верхний край
+        safe_depths = np.where(depths > 0.001, depths, 1.0)
+        wall_heights = np.where(depths > 0.001, (height / (safe_depths + 0.0001)).astype(np.int64), height)
+        wall_heights = np.clip(wall_heights, 1, height * 2)
+        wall_tops = height // 2 - wall_heights // 2
+
+        # Берём уже затемнённый столбец текстуры для каждого луча
+        colormaps = self.colormaps
+        types = np.where(wall_types < colormaps.num_textures, wall_types, 0)
+        tex_x = (offsets * size).astype(np.int64) % size
+        levels = colormaps.wall_levels(depths)
+        columns = colormaps.walls[horizontal.astype(np.intp), levels, types, tex_x]
+        plain = ~colormaps.textured[types]
+        if plain.any():
+            # Стена без текстуры — сплошной цвет
+            columns[plain] = colormaps.untextured_pixels(depths[plain], horizontal[plain])[:, None]
+
+        # Столбец с потолком в начале и полом в конце: [потолок, тексели..., пол]
+        extended = np.empty((num_rays, size + 2), dtype=np.uint32)
+        extended[:, 0] = self.ceiling_pixel
+        extended[:, 1:size + 1] = columns
+        extended[:, size + 1] = self.floor_pixel
+
+        # Растягиваем столбцы на высоту стены: всё выше стены попадает
+        # в ячейку потолка, всё ниже — в ячейку пола
+        steps = (size / wall_heights).astype(np.float32)
+        texel = (self.rows[None, :] - wall_tops[:, None].astype(np.float32)) * steps[:, None]
+        np.clip(texel + 1, 0, size + 1, out=texel)
+        texel_index = texel.astype(np.intp)
+        pixels = np.take_along_axis(extended, texel_index, axis=1)
+        if flats is not None:
+            # Вне стены — текстурированные пол и потолок
+            np.copyto(pixels, flats, where=(texel_index == 0) | (texel_index == size + 1))
+
+        # Каждый луч занимает scale пикселей по ширине
+        stop = (first + num_rays) * scale
+        self.frame[first * scale:stop].reshape(num_rays, scale, height)[:] = pixels[:, None]
+        if first + num_rays == (total or num_rays):
+            # Если ширина экрана не делится на число лучей, справа остаются столбцы без луча
+            self.frame[stop:] = self.background
+
+    def present(self):
+        """Выводит кадровый буфер на экран одним вызовом"""
+        pygame.surfarray.blit_array(self.surface, self.frame)
+
+
+class SpriteAtlas:
+    """Заранее нарисованные спрайты и кэш их масштабированных копий.
+
+    Каждый тип врага (по кадру на шаг анимации) и каждый тип предмета
+    рисуется один раз в общий атлас высотой SPRITE_BASE_HEIGHT. В кадре
+    высота спрайта квантуется (шаг SPRITE_HEIGHT_STEP), а уровень света
+    берётся из таблиц освещения; копия с такими высотой и светом
+    масштабируется и затемняется один раз и лежит в LRU-кэше, так что
+    спрайт любой сложности стоит одного blit.
+    """
+
+    def __init__(self, colormaps: ColorMaps, max_size: int = SPRITE_CACHE_SIZE):
+        self.colormaps = colormaps
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+        # Кадры: ключ -> (цвет, доля ширины от высоты, функция рисования)
+        frames = {}
+        for enemy_type, params in list(ENEMY_TYPES.items()) + [(None, ENEMY_DEFAULTS)]:
+            for frame in range(ENEMY_ANIMATION_FRAMES):
+                frames[("enemy", enemy_type, frame)] = (params["color"], params["size"], self.draw_enemy)
+        for pickup_type in Pickup.TYPES:
+            pickup = Pickup(0, 0, pickup_type)
+            frames[("pickup", pickup_type, 0)] = (pickup.color, pickup.size * 2, self.draw_pickup)
+
+        # Все кадры — в ряд на одной поверхности
+        height = SPRITE_BASE_HEIGHT
+        widths = [max(1, int(height * aspect)) for _, aspect, _ in frames.values()]
+        self.surface = pygame.Surface((sum(widths), height), pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+        self.frames = {}
+        x = 0
+        for (key, (color, _, draw)), width in zip(frames.items(), widths):
+            rect = pygame.Rect(x, 0, width, height)
+            draw(self.surface.subsurface(rect), color, key[2])
+            self.frames[key] = rect
+            x += width
+
+    @staticmethod
+    def draw_enemy(surface: pygame.Surface, color: Tuple[int, int, int], frame: int):
+        """Тело-эллипс с глазами; кадры анимации — лёгкое «дыхание» и взгляд по сторонам"""
+        width, height = surface.get_size()
+        squash = (0, 2, 4, 2)[frame] * height // 128
+        pygame.draw.ellipse(surface, color, (squash, squash * 2, width - 2 * squash, height - squash * 2))
+        eye_y = height // 4 + squash * 2
+        eye_size = max(2, width // 6)
+        look = (0, 1, 0, -1)[frame] * eye_size // 2
+        pygame.draw.circle(surface, YELLOW, (width // 3 + look, eye_y), eye_size)
+        pygame.draw.circle(surface, YELLOW, (2 * width // 3 + look, eye_y), eye_size)
+
+    @staticmethod
+    def draw_pickup(surface: pygame.Surface, color: Tuple[int, int, int], frame: int):
+        """Ящик с рамкой в нижней половине кадра (предмет лежит на полу)"""
+        width, height = surface.get_size()
+        box = pygame.Rect(0, height // 4, width, height // 2)
+        pygame.draw.rect(surface, color, box)
+        pygame.draw.rect(surface, WHITE, box, max(1, height // 64))
+
+    @staticmethod
+    def quantize(height: int) -> int:
+        """Ближайшая высота из геометрической сетки с шагом SPRITE_HEIGHT_STEP"""
+        if height < 8:
+            return max(height, 1)
+        return int(round(SPRITE_HEIGHT_STEP ** round(math.log(height, SPRITE_HEIGHT_STEP))))
+
+    def frame_key(self, kind: str, sprite_type: Optional[str], frame: int) -> tuple:
+        key = (kind, sprite_type, frame)
+        return key if key in self.frames else (kind, None, frame)
+
+    def size(self, kind: str, sprite_type: Optional[str], frame: int, height: int) -> Tuple[int, int]:
+        """Размер спрайта на экране — без масштабирования, чтобы заранее отсечь скрытые"""
+        rect = self.frames[self.frame_key(kind, sprite_type, frame)]
+        height = self.quantize(height)
+        return max(1, rect.width * height // rect.height), height
+
+    def get(self, kind: str, sprite_type: Optional[str], frame: int, height: int, distance: float) -> pygame.Surface:
+        """Спрайт высотой около height, затемнённый для расстояния distance"""
+        key = self.frame_key(kind, sprite_type, frame)
+        height = self.quantize(height)
+        level = self.colormaps.sprite_level(distance)
+        cache_key = (key, height, level)
+
+        sprite = self.cache.get(cache_key)
+        if sprite is not None:
+            self.cache.move_to_end(cache_key)
+            return sprite
+
+        rect = self.frames[key]
+        width = max(1, rect.width * height // rect.height)
+        sprite = pygame.transform.scale(self.surface.subsurface(rect), (width, height))
+        light = int(255 * self.colormaps.brightness[level])
+        if light < 255:
+            sprite.fill((light, light, light), special_flags=pygame.BLEND_RGB_MULT)
+        self.cache[cache_key] = sprite
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return sprite
+
+
+class StripPool:
+    """Пул потоков, делящий столбцы кадра на полосы.
+
+    Ядра полос — операции NumPy, которые отпускают GIL, а полосы пишут в
+    непересекающиеся части общих буферов; каждый столбец считается теми же
+    операциями, что и без пула, поэтому кадр не зависит от числа потоков.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS):
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="render") if self.workers > 1 else None
+
+    def strips(self, count: int) -> List[Tuple[int, int]]:
+        """Границы полос [start, stop) примерно равной ширины"""
+        bounds = np.linspace(0, count, min(self.workers, count) + 1).astype(int).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def run(self, func, count: int, *args):
+        """Вызываем func(start, stop, *args) для каждой полосы и ждём все"""
+        strips = self.strips(count)
+        if self.executor is None or len(strips) == 1:
+            for start, stop in strips:
+                func(start, stop, *args)
+            return
+        for future in [self.executor.submit(func, start, stop, *args) for start, stop in strips]:
+            future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class Level:
+    """Уровень из файла levels/levelN.json.
+
+    Формат файла:
+        name    — название уровня;
+        player  — стартовая позиция игрока [x, y];
+        map     — строки карты, по символу на тайл: 0 — пусто, 1-9 — тип стены;
+        enemies, pickups — списки {"type", "x", "y"}.
+
+    При первой загрузке уровень компилируется в каталог кэша: сетка стен и
+    производные данные (маска шагов для поля путей и т.п.) — файлами .npy,
+    сущности — в level.json. Имя каталога содержит хэш пути к файлу и хэш
+    его содержимого, поэтому правка уровня сама делает старый кэш
+    недействительным, а одноимённые уровни из разных каталогов друг другу не
+    мешают. Повторные загрузки отображают массивы в память (mmap) вместо
+    пересчёта.
+    """
+
+    def __init__(self, path: str, cache_dir: Optional[str] = LEVEL_CACHE_DIR):
+        self.path = path
+        with open(path, "rb") as f:
+            source = f.read()
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha256(source + f"/v{LEVEL_CACHE_VERSION}".encode()).hexdigest()[:16]
+        location = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+        # Общий префикс всех версий кэша этого файла
+        self.stem = stem
+        self.cache_prefix = f"{stem}-{location}-"
+        self.cache_path = os.path.join(cache_dir, f"{self.cache_prefix}{digest}") if cache_dir else None
+        self.source = source
+        self.arrays = {}
+
+        meta_path = os.path.join(self.cache_path, "level.json") if self.cache_path else None
+        if meta_path and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            meta = self.compile(json.loads(source), cache_dir)
+
+        self.name = meta["name"]
+        self.player_start = tuple(meta["player"])
+        self.enemies = [(e["x"], e["y"], e["type"]) for e in meta["enemies"]]
+        self.pickups = [(p["x"], p["y"], p["type"]) for p in meta["pickups"]]
+        self.grid = self.array("grid")
+        self.moves = self.array("moves", lambda level: FlowField.compile_moves(level.grid))
+
+    def parse_grid(self, data: dict) -> np.ndarray:
+        rows = data["map"]
+        if not rows or any(len(row) != len(rows[0]) for row in rows):
+            raise ValueError(f"{self.path}: строки карты должны быть непустыми и одной длины")
+        if not all(row.isdigit() and row.isascii() for row in rows):
+            raise ValueError(f"{self.path}: в карте допустимы только цифры 0-9")
+        return np.array([[int(cell) for cell in row] for row in rows], dtype=np.int32)
+
+    def compile(self, data: dict, cache_dir: Optional[str]) -> dict:
+        """Разбираем исходный файл и складываем результат в кэш"""
+        grid = self.parse_grid(data)
+        for entity in data.get("enemies", []):
+            if entity["type"] not in ENEMY_TYPES:
+                raise ValueError(f"{self.path}: неизвестный тип врага {entity['type']!r}")
+        for entity in data.get("pickups", []):
+            if entity["type"] not in Pickup.TYPES:
+                raise ValueError(f"{self.path}: неизвестный тип предмета {entity['type']!r}")
+
+        meta = {
+            "name": data.get("name", self.stem),
+            "player": data.get("player", [1.5, 1.5]),
+            "enemies": data.get("enemies", []),
+            "pickups": data.get("pickups", []),
+        }
+        self.arrays["grid"] = grid
+        if self.cache_path is None:
+            return meta
+
+        # Пишем во временный каталог и переименовываем, чтобы не оставить полузаписанный кэш
+        tmp_path = f"{self.cache_path}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+            np.save(os.path.join(tmp_path, "grid.npy"), grid)
+            with open(os.path.join(tmp_path, "level.json"), "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # Кэш недоступен (или его уже записал другой процесс) — работаем из памяти
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return meta
+
+        # Кэши прежних версий этого файла больше не нужны
+        for name in os.listdir(cache_dir):
+            if name.startswith(self.cache_prefix) and os.path.join(cache_dir, name) != self.cache_path:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        return meta
+
+    def array(self, name: str, compute=None) -> np.ndarray:
+        """Массив уровня: из памяти, из кэша через mmap, иначе compute(level) с записью в кэш"""
+        if name in self.arrays:
+            return self.arrays[name]
+        path = os.path.join(self.cache_path, f"{name}.npy") if self.cache_path else None
+        if path and os.path.exists(path):
+            array = np.load(path, mmap_mode="r")
+        elif compute is None:
+            # Кэш удалили из-под нас (например, другой экземпляр игры) — собираем уровень заново
+            if path:
+                self.compile(json.loads(self.source), os.path.dirname(self.cache_path))
+            if name not in self.arrays:
+                raise KeyError(f"{self.path}: в кэше уровня нет массива {name!r}")
+            return self.arrays[name]
+        else:
+            array = compute(self)
+            if path:
+                try:
+                    tmp_path = f"{path}.tmp{os.getpid()}.npy"
+                    np.save(tmp_path, array)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    pass
+        self.arrays[name] = array
+        return array
+
+
+def save_level(data: dict, path: str):
+    """Записываем уровень в формате levels/*.json: строка карты и сущность — на строку.
+    Параметры генератора (ключ generator) сохраняются, чтобы уровень можно было собрать заново"""
+    def entities(items):
+        return ",\n".join(f"    {json.dumps(item)}" for item in items)
+
+    rows = ",\n".join(f'    "{row}"' for row in data["map"])
+    text = (f'{{\n  "name": {json.dumps(data["name"])},\n  "player": {json.dumps(data["player"])},\n'
+            f'  "map": [\n{rows}\n  ],\n'
+            f'  "enemies": [\n{entities(data["enemies"])}\n  ],\n'
+            f'  "pickups": [\n{entities(data["pickups"])}\n  ]')
+    if "generator" in data:
+        text += f',\n  "generator": {json.dumps(data["generator"])}'
+    text += "\n}\n"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def generate_level(width: int, height: int, seed: int = 0, room_density: float = 0.35,
+                   corridor_density: float = 0.25, enemies: Optional[int] = None,
+                   pickup_density: float = 0.01) -> dict:
+    """Случайный уровень для нагрузочных прогонов, в формате levels/*.json.
+
+    room_density — доля площади карты под комнатами, corridor_density —
+    доля комнат с дополнительным коридором (петлёй) к случайной соседней,
+    enemies — число врагов (по умолчанию один на 40 свободных тайлов),
+    pickup_density — предметов на свободный тайл. Одинаковые параметры
+    дают одинаковую карту.
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.ones((height, width), dtype=np.int32)
+
+    # Комнаты: прямоугольники 4..12 тайлов, могут сливаться друг с другом
+    count = max(2, int(room_density * (width - 2) * (height - 2) / 64))
+    sizes_w = rng.integers(4, 13, count)
+    sizes_h = rng.integers(4, 13, count)
+    rooms_x = rng.integers(1, np.maximum(width - 1 - sizes_w, 2))
+    rooms_y = rng.integers(1, np.maximum(height - 1 - sizes_h, 2))
+    for x, y, w, h in zip(rooms_x.tolist(), rooms_y.tolist(), sizes_w.tolist(), sizes_h.tolist()):
+        grid[y:min(y + h, height - 1), x:min(x + w, width - 1)] = 0
+
+    # Коридоры между соседними по «змейке» комнатами — все комнаты связны,
+    # а коридоры остаются короткими
+    centers_x = np.minimum(rooms_x + sizes_w // 2, width - 2)
+    centers_y = np.minimum(rooms_y + sizes_h // 2, height - 2)
+    band = centers_y // 24
+    order = np.lexsort((np.where(band % 2 == 0, centers_x, -centers_x), band))
+    links = list(zip(order[:-1].tolist(), order[1:].tolist()))
+    rank = np.empty(count, dtype=np.int64)
+    rank[order] = np.arange(count)
+    extra = np.flatnonzero(rng.random(count) < corridor_density)
+    partners = order[np.clip(rank[extra] + rng.integers(-4, 5, len(extra)), 0, count - 1)]
+    links += list(zip(extra.tolist(), partners.tolist()))
+    for a, b in links:
+        ax, ay, bx, by = int(centers_x[a]), int(centers_y[a]), int(centers_x[b]), int(centers_y[b])
+        grid[ay, min(ax, bx):max(ax, bx) + 1] = 0
+        grid[min(ay, by):max(ay, by) + 1, bx] = 0
+
+    # Тип стены меняется блоками 8x8, граница карты — обычная стена
+    block_types = rng.integers(1, 4, ((height + 7) // 8, (width + 7) // 8))
+    wall_types = np.repeat(np.repeat(block_types, 8, axis=0), 8, axis=1)[:height, :width]
+    grid = np.where(grid > 0, wall_types, 0)
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 1
+
+    # Игрок — в центре первой комнаты, сущности — не ближе 3 тайлов к нему
+    start = order[0]
+    player = [int(centers_x[start]) + 0.5, int(centers_y[start]) + 0.5]
+    free_y, free_x = np.nonzero(grid == 0)
+    far = (np.abs(free_x + 0.5 - player[0]) > 3) | (np.abs(free_y + 0.5 - player[1]) > 3)
+    free_x, free_y = free_x[far], free_y[far]
+
+    if enemies is None:
+        enemies = len(free_x) // 40
+    enemies = min(enemies, len(free_x))
+    picked = rng.choice(len(free_x), enemies, replace=False)
+    types = rng.choice(["imp", "demon", "baron"], enemies, p=[0.5, 0.35, 0.15])
+
+    pickups = min(int(pickup_density * len(free_x)), len(free_x))
+    placed = rng.choice(len(free_x), pickups, replace=False)
+    pickup_types = rng.choice(list(Pickup.TYPES), pickups)
+
+    return {
+        "name": f"Generated {width}x{height} #{seed}",
+        "player": player,
+        "map": ["".join(map(str, row)) for row in grid.tolist()],
+        "enemies": [{"type": str(t), "x": float(free_x[i]) + 0.5, "y": float(free_y[i]) + 0.5}
+                    for i, t in zip(picked.tolist(), types.tolist())],
+        "pickups": [{"type": str(t), "x": float(free_x[i]) + 0.5, "y": float(free_y[i]) + 0.5}
+                    for i, t in zip(placed.tolist(), pickup_types.tolist())],
+    }
+
+
+def generated_level_path(width: int, height: int, **params) -> str:
+    """Файл сгенерированного уровня; генерируем, только если такого ещё нет"""
+    key = json.dumps([GENERATOR_VERSION, width, height, sorted(params.items())])
+    digest = hashlib.sha256(key.encode()).hexdigest()[:8]
+    path = os.path.join(GENERATED_LEVELS_DIR, f"gen-{width}x{height}-s{params.get('seed', 0)}-{digest}.json")
+    if not os.path.exists(path):
+        data = generate_level(width, height, **params)
+        data["generator"] = {"version": GENERATOR_VERSION, "width": width, "height": height, "params": params}
+        save_level(data, path)
+    return path
+
+
+class GlyphAtlas:
+    """Шрифт, запечённый в атлас глифов.
+
+    Печатные символы ASCII один раз рендерятся через pygame.font в полосу
+    альфа-масок, а для каждой пары символов запоминается сдвиг пера с учётом
+    кернинга. Всё это сохраняется в кэш ассетов, и при следующих запусках
+    SDL_ttf не инициализируется вовсе. render() повторяет интерфейс
+    pygame.font.Font: строка собирается из масок глифов и окрашивается.
+    """
+
+    CHARS = "".join(chr(code) for code in range(32, 127))
+
+    def __init__(self, alpha: np.ndarray, offsets: np.ndarray, heights: np.ndarray, advances: np.ndarray):
+        self.alpha = alpha  # [x, y]: глифы подряд по горизонтали
+        self.offsets = offsets.tolist()  # Начало глифа i в полосе; последний элемент — её ширина
+        self.heights = heights.tolist()
+        self.advances = advances.tolist()  # [i][j]: сдвиг пера после символа i, если за ним идёт j
+        self.index = {char: i for i, char in enumerate(self.CHARS)}
+        self.fallback = self.index["?"]
+
+    @classmethod
+    def load(cls, size: int, cache: Optional[AssetCache] = None) -> "GlyphAtlas":
+        """Атлас встроенного шрифта pygame заданного размера"""
+        def build():
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.Font(None, size)
+            glyphs = [pygame.surfarray.array_alpha(font.render(char, True, WHITE)) for char in cls.CHARS]
+            offsets = np.cumsum([0] + [len(glyph) for glyph in glyphs])
+            # Глифы с выносными элементами бывают на строку выше остальных — выравниваем по верху
+            heights = np.array([glyph.shape[1] for glyph in glyphs])
+            alpha = np.zeros((offsets[-1], heights.max()), dtype=np.uint8)
+            for glyph, start in zip(glyphs, offsets):
+                alpha[start:start + len(glyph), :glyph.shape[1]] = glyph
+            # Ширина пары минус ширина второго символа — сдвиг пера после первого
+            widths = [font.size(char)[0] for char in cls.CHARS]
+            advances = np.array([[font.size(first + second)[0] - widths[j] for j, second in enumerate(cls.CHARS)]
+                                 for first in cls.CHARS], dtype=np.int16)
+            return {"alpha": alpha, "offsets": offsets, "heights": heights, "advances": advances}
+
+        arrays = (cache or AssetCache()).get("font", [size, cls.CHARS], build)
+        return cls(arrays["alpha"], arrays["offsets"], arrays["heights"], arrays["advances"])
+
+    def render(self, text: str, antialias: bool, color: Tuple[int, int, int]) -> pygame.Surface:
+        offsets, advances = self.offsets, self.advances
+        glyphs = [self.index.get(char, self.fallback) for char in text]
+        positions = [0]
+        for first, second in zip(glyphs, glyphs[1:]):
+            positions.append(positions[-1] + advances[first][second])
+        width = max((x + offsets[i + 1] - offsets[i] for x, i in zip(positions, glyphs)), default=1)
+        # Высота строки, как у SDL_ttf, — по самому высокому из её глифов
+        height = max((self.heights[i] for i in glyphs), default=self.heights[0])
+
+        surface = pygame.Surface((max(width, 1), height), pygame.SRCALPHA)
+        surface.fill(color)
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        alpha[:] = 0
+        for x, i in zip(positions, glyphs):
+            start, stop = offsets[i], offsets[i + 1]
+            # Соседние глифы с кернингом могут перекрываться
+            np.maximum(alpha[x:x + stop - start], self.alpha[start:stop, :height], out=alpha[x:x + stop - start])
+        del alpha
+        return surface
+
+
+class TextCache:
+    """LRU-кэш отрендеренного текста: (шрифт, текст, цвет) -> Surface"""
+
+    def __init__(self, max_size: int = TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, font: GlyphAtlas, text: str, color: Tuple[int, int, int]) -> pygame.Surface:
+        key = (id(font), text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+
+class HudLayer:
+    """HUD, заранее собранный на одной полупрозрачной поверхности.
+
+    Каждый виджет занимает свой прямоугольник и перерисовывается только
+    когда меняется его значение; в кадре остаётся один blit.
+    """
+
+    def __init__(self, font: GlyphAtlas, text_cache: TextCache):
+        self.font = font
+        self.text_cache = text_cache
+        self.surface = pygame.Surface((SCREEN_WIDTH, HUD_HEIGHT), pygame.SRCALPHA)
+        self.surface.fill(HUD_BACKGROUND)
+        self.values = {}
+
+        # Виджет: (область на HUD, функция отрисовки значения)
+        self.widgets = {
+            "health": (pygame.Rect(15, 5, 180, 65), self.draw_health),
+            "armor": (pygame.Rect(195, 5, 180, 65), self.draw_armor),
+            "ammo": (pygame.Rect(395, 5, 300, 70), self.draw_ammo),
+            "enemies": (pygame.Rect(SCREEN_WIDTH - 405, 5, 200, 70), self.draw_enemies),
+            "score": (pygame.Rect(SCREEN_WIDTH - 205, 5, 205, 32), self.draw_score),
+            "level": (pygame.Rect(SCREEN_WIDTH - 205, 37, 205, 38), self.draw_level),
+        }
+
+    def text(self, text: str, color: Tuple[int, int, int], pos: Tuple[int, int]):
+        self.surface.blit(self.text_cache.render(self.font, text, color), pos)
+
+    def draw_bar(self, x: int, value: int, max_value: int, back_color, color):
+        pygame.draw.rect(self.surface, back_color, (x, 40, 150, 20))
+        pygame.draw.rect(self.surface, color, (x, 40, int(150 * (value / max_value)), 20))
+        pygame.draw.rect(self.surface, WHITE, (x, 40, 150, 20), 2)
+
+    def draw_health(self, value):
+        health, max_health = value
+        self.text(f"HEALTH: {health}", RED, (20, 10))
+        self.draw_bar(20, health, max_health, (100, 0, 0), RED)
+
+    def draw_armor(self, value):
+        armor, max_armor = value
+        self.text(f"ARMOR: {armor}", BLUE, (200, 10))
+        self.draw_bar(200, armor, max_armor, (0, 0, 100), BLUE)
+
+    def draw_ammo(self, value):
+        self.text(f"AMMO: {value[0]}/{value[1]}", YELLOW, (400, 25))
+
+    def draw_enemies(self, value):
+        self.text(f"ENEMIES: {value}", RED, (SCREEN_WIDTH - 400, 25))
+
+    def draw_score(self, value):
+        self.text(f"SCORE: {value}", WHITE, (SCREEN_WIDTH - 200, 10))
+
+    def draw_level(self, value):
+        self.text(f"LEVEL: {value}", WHITE, (SCREEN_WIDTH - 200, 40))
+
+    def update(self, values: dict):
+        """Перерисовываем только виджеты с изменившимся значением"""
+        for name, value in values.items():
+            if self.values.get(name) != value:
+                rect, draw = self.widgets[name]
+                self.surface.fill(HUD_BACKGROUND, rect)
+                draw(value)
+                self.values[name] = value
+
+    def render(self, surface: pygame.Surface):
+        surface.blit(self.surface, (0, SCREEN_HEIGHT - HUD_HEIGHT))
+
+
+class Minimap:
+    """Мини-карта: статичный слой стен запекается один раз на уровень,
+    поверх каждый кадр рисуются только враги, предметы и игрок.
+
+    Если карта не помещается в MINIMAP_MAX_SIZE, показывается окно
+    (viewport) вокруг игрока, и рисуются только объекты в этом окне. Стены
+    тогда запекаются не для всей карты, а для участка с запасом в
+    MINIMAP_MARGIN тайлов, который перезапекается, когда окно из него выходит.
+    """
+    WALL_COLORS = {1: (100, 100, 100), 2: (80, 80, 100)}
+    OTHER_WALL_COLOR = (100, 80, 80)
+
+    def __init__(self, grid: np.ndarray, scale: int = MINIMAP_SCALE,
+                 max_size: Tuple[int, int] = MINIMAP_MAX_SIZE):
+        self.scale = scale
+        map_h, map_w = grid.shape
+        self.map_size = (map_w * scale, map_h * scale)
+        self.view_size = (min(self.map_size[0], max_size[0]), min(self.map_size[1], max_size[1]))
+        self.viewport = self.view_size != self.map_size
+        self.grid = grid
+        # Запечённый участок карты: левый верхний тайл и размер в тайлах
+        self.window = (0, 0)
+        self.window_size = (min(map_w, self.view_size[0] // scale + 1 + 2 * MINIMAP_MARGIN),
+                            min(map_h, self.view_size[1] // scale + 1 + 2 * MINIMAP_MARGIN))
+        self.background = None if self.viewport else self.bake(grid)
+        self.surface = pygame.Surface(self.view_size)
+        self.surface.set_alpha(180)
+
+    def bake(self, grid: np.ndarray) -> pygame.Surface:
+        """Рисуем стены участка карты в одну поверхность (без draw-вызовов на тайл)"""
+        scale = self.scale
+        colors = np.empty(grid.shape + (3,), dtype=np.uint8)
+        colors[:] = self.OTHER_WALL_COLOR
+        colors[grid <= 0] = 0
+        for cell, color in self.WALL_COLORS.items():
+            colors[grid == cell] = color
+
+        # Тайл -> квадрат scale x scale с чёрным зазором в последнем столбце и строке
+        pixels = np.repeat(np.repeat(colors, scale, axis=0), scale, axis=1)
+        pixels[scale - 1::scale, :] = 0
+        pixels[:, scale - 1::scale] = 0
+        return pygame.surfarray.make_surface(pixels.transpose(1, 0, 2))
+
+    def origin(self, x: float, y: float) -> Tuple[int, int]:
+        """Левый верхний угол окна в пикселях карты: игрок в центре, окно не выходит за карту"""
+        if not self.viewport:
+            return 0, 0
+        view_w, view_h = self.view_size
+        map_w, map_h = self.map_size
+        left = min(max(int(x * self.scale) - view_w // 2, 0), map_w - view_w)
+        top = min(max(int(y * self.scale) - view_h // 2, 0), map_h - view_h)
+        return left, top
+
+    def baked_window(self, left: int, top: int) -> Tuple[int, int]:
+        """Запекаем участок карты, если окно [left, top] из текущего вышло; возвращаем его угол в пикселях"""
+        scale = self.scale
+        window_x, window_y = self.window
+        window_w, window_h = self.window_size
+        tile_x0, tile_y0 = left // scale, top // scale
+        tile_x1 = (left + self.view_size[0] - 1) // scale + 1
+        tile_y1 = (top + self.view_size[1] - 1) // scale + 1
+        if (self.background is None or tile_x0 < window_x or tile_y0 < window_y or
+                tile_x1 > window_x + window_w or tile_y1 > window_y + window_h):
+            map_h, map_w = self.grid.shape
+            window_x = min(max(tile_x0 - MINIMAP_MARGIN, 0), map_w - window_w)
+            window_y = min(max(tile_y0 - MINIMAP_MARGIN, 0), map_h - window_h)
+            self.window = (window_x, window_y)
+            self.background = self.bake(self.grid[window_y:window_y + window_h, window_x:window_x + window_w])
+        return window_x * scale, window_y * scale
+
+    def render(self, screen: pygame.Surface, pos: Tuple[int, int], view: Tuple[float, float, float],
+               enemy_grid: "SpatialGrid", pickup_grid: "SpatialGrid", alpha: float):
+        view_x, view_y, view_angle = view
+        scale = self.scale
+        left, top = self.origin(view_x, view_y)
+        surface = self.surface
+        baked_left, baked_top = self.baked_window(left, top)
+        surface.blit(self.background, (0, 0), pygame.Rect((left - baked_left, top - baked_top), self.view_size))
+
+        # Только объекты в окне (с запасом в тайл на интерполяцию и радиус точки)
+        x0, y0 = left / scale - 1, top / scale - 1
+        x1, y1 = (left + self.view_size[0]) / scale + 1, (top + self.view_size[1]) / scale + 1
+
+        # Рисуем врагов
+        for enemy in sorted(enemy_grid.query_rect(x0, y0, x1, y1), key=lambda e: e._index):
+            enemy_pos = enemy.prev_pos.lerp(enemy.pos, alpha)
+            pygame.draw.circle(surface, enemy.color,
+                               (int(enemy_pos.x * scale) - left, int(enemy_pos.y * scale) - top), 3)
+
+        # Рисуем предметы
+        for pickup in pickup_grid.query_rect(x0, y0, x1, y1):
+            pygame.draw.circle(surface, pickup.color,
+                               (int(pickup.pos.x * scale) - left, int(pickup.pos.y * scale) - top), 2)
+
+        # Рисуем игрока
+        player_x = int(view_x * scale) - left
+        player_y = int(view_y * scale) - top
+        pygame.draw.circle(surface, GREEN, (player_x, player_y), 3)
+
+        # Направление взгляда
+        look_x = player_x + int(math.cos(view_angle) * 10)
+        look_y = player_y + int(math.sin(view_angle) * 10)
+        pygame.draw.line(surface, GREEN, (player_x, player_y), (look_x, look_y), 2)
+
+        screen.blit(surface, pos)
+
+
+class ResolutionScaler:
+    """Динамическое разрешение по бюджету времени кадра.
+
+    Смотрит на среднее время кадра за RESOLUTION_WINDOW кадров и сдвигает
+    ступень RESOLUTION_STEPS (число лучей и делитель пола/потолка) в
+    пределах [min_rays, max_rays]. Гистерезис: понижаем при превышении
+    бюджета в RESOLUTION_DOWN раз, повышаем лишь при запасе до
+    RESOLUTION_UP, и после каждой смены выжидаем RESOLUTION_COOLDOWN кадров.
+    Если со ступени уже пришлось уходить вниз, вернуться на неё можно только
+    после вдвое большей выдержки, чем в прошлый раз, — так разрешение не
+    качается между двумя соседними ступенями.
+    """
+
+    def __init__(self, target_ms: float, min_rays: int = 0, max_rays: int = SCREEN_WIDTH,
+                 steps: Tuple[Tuple[int, int], ...] = RESOLUTION_STEPS):
+        self.target_ms = target_ms
+        self.steps = [step for step in steps if min_rays <= step[0] <= max_rays] or [steps[0]]
+        self.step = 0
+        self.frame_times = deque(maxlen=RESOLUTION_WINDOW)
+        self.cooldown = 0
+        self.frames_at_step = 0
+        self.retry_after = {}  # ступень -> сколько кадров выждать перед возвратом на неё
+        self.decisions = []  # (кадр, со ступени, на ступень, среднее мс)
+
+    @property
+    def num_rays(self) -> int:
+        return self.steps[self.step][0]
+
+    @property
+    def flat_divisor(self) -> int:
+        return self.steps[self.step][1]
+
+    def update(self, frame_index: int, frame_ms: float) -> bool:
+        """Учитываем время кадра; True, если ступень сменилась"""
+        self.frame_times.append(frame_ms)
+        self.frames_at_step += 1
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return False
+        if len(self.frame_times) < self.frame_times.maxlen:
+            return False
+
+        average = sum(self.frame_times) / len(self.frame_times)
+        step = self.step
+        if average > self.target_ms * RESOLUTION_DOWN and step < len(self.steps) - 1:
+            step += 1
+        elif (average < self.target_ms * RESOLUTION_UP and step > 0 and
+              self.frames_at_step >= self.retry_after.get(step - 1, 0)):
+            step -= 1
+        if step == self.step:
+            return False
+
+        if step > self.step:
+            self.retry_after[self.step] = max(self.retry_after.get(self.step, RESOLUTION_COOLDOWN // 2) * 2,
+                                              self.frames_at_step)
+
+        self.decisions.append((frame_index, self.step, step, average))
+        self.step = step
+        self.frame_times.clear()
+        self.cooldown = RESOLUTION_COOLDOWN
+        self.frames_at_step = 0
+        return True
+
+
+class FrameProfiler:
+    """Профайлер стадий кадра.
+
+    Меряет время каждой стадии игрового цикла, показывает разбивку
+    поверх игры (F3) и, если задан файл, построчно пишет замеры каждого
+    кадра в CSV или JSON Lines.
+    """
+
+    STAGES = (
+        "events", "handle_input", "update_enemies", "check_pickups", "check_level_complete",
+        "render_3d", "render_sprites", "render_weapon", "render_hud", "render_minimap",
+        "render_screen", "present",
+    )
+    # Значения, которые держатся между кадрами (например, текущее разрешение)
+    COUNTERS = ("num_rays", "flat_divisor", "resolution_step")
+
+    def __init__(self, output_path: Optional[str] = None, history: int = PROFILER_HISTORY):
+        self.show_overlay = False
+        self.frame_index = 0
+        self.timings = {}
+        self.history = deque(maxlen=history)
+        self.frame_start = time.perf_counter()
+        self.font = None
+        # Свой кэш строк: меняющиеся каждый кадр числа не вытесняют строки HUD из общего
+        self.text_cache = TextCache()
+        self.counters = {}
+        self.last_total = 0.0
+
+        self.output = None
+        self.writer = None
+        if output_path:
+            self.output = open(output_path, "w", newline="")
+            if output_path.endswith(".csv"):
+                self.writer = csv.writer(self.output)
+                self.writer.writerow(("frame", "total_ms") + self.STAGES + self.COUNTERS)
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def call(self, stage: str, func, *args):
+        """Вызывает func(*args), записывая время в стадию stage"""
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+    def record(self, stage: str, start: float):
+        """Записывает в стадию время, прошедшее с момента start"""
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def set_counter(self, name: str, value):
+        self.counters[name] = value
+
+    def end_frame(self):
+        total = time.perf_counter() - self.frame_start
+        self.last_total = total
+        timings = self.timings
+        self.timings = {}
+        self.history.append((total, timings))
+
+        if self.output:
+            if self.writer:
+                self.writer.writerow([self.frame_index, round(total * 1000, 4)] +
+                                     [round(timings.get(stage, 0.0) * 1000, 4) for stage in self.STAGES] +
+                                     [self.counters.get(name, "") for name in self.COUNTERS])
+            else:
+                row = {"frame": self.frame_index, "total_ms": round(total * 1000, 4)}
+                row.update((stage, round(value * 1000, 4)) for stage, value in timings.items())
+                row.update(self.counters)
+                self.output.write(json.dumps(row) + "\n")
+        self.frame_index += 1
+
+    def averages(self) -> Tuple[float, dict]:
+        """Среднее время кадра и стадий (мс) по последним кадрам"""
+        if not self.history:
+            return 0.0, {}
+        count = len(self.history)
+        total = sum(frame_total for frame_total, _ in self.history) / count * 1000
+        stages = {}
+        for _, timings in self.history:
+            for stage, value in timings.items():
+                stages[stage] = stages.get(stage, 0.0) + value
+        return total, {stage: value / count * 1000 for stage, value in stages.items()}
+
+    def render_overlay(self, surface: pygame.Surface) -> pygame.Rect:
+        """Рисуем разбивку времени кадра по стадиям, возвращаем занятую область"""
+        if self.font is None:
+            self.font = GlyphAtlas.load(22)
+
+        def text(line: str, color: Tuple[int, int, int]) -> pygame.Surface:
+            return self.text_cache.render(self.font, line, color)
+
+        total, stages = self.averages()
+        lines = [(stage, stages[stage]) for stage in self.STAGES if stage in stages]
+        counters = [(name, self.counters[name]) for name in self.COUNTERS if name in self.counters]
+        width, line_height = 300, 18
+        panel = pygame.Surface((width, (len(lines) + len(counters) + 1) * line_height + 10))
+        panel.fill((0, 0, 0))
+        panel.set_alpha(190)
+        panel_rect = surface.blit(panel, (SCREEN_WIDTH - width - 10, 50))
+
+        x = SCREEN_WIDTH - width - 5
+        y = 55
+        header = text(f"frame {total:6.2f} ms", YELLOW)
+        surface.blit(header, (x, y))
+        for stage, value in lines:
+            y += line_height
+            share = value / total if total > 0 else 0
+            pygame.draw.rect(surface, DARK_RED, (x + 180, y + 3, int(110 * min(share, 1.0)), 10))
+            surface.blit(text(stage, WHITE), (x, y))
+            value_text = text(f"{value:.2f}", WHITE)
+            surface.blit(value_text, value_text.get_rect(topright=(x + 172, y)))
+        for name, value in counters:
+            y += line_height
+            surface.blit(text(name, LIGHT_GRAY), (x, y))
+            value_text = text(str(value), LIGHT_GRAY)
+            surface.blit(value_text, value_text.get_rect(topright=(x + 172, y)))
+        return panel_rect
+
+    def close(self):
+        if self.output:
+            self.output.close()
+            self.output = None
+
+
+class StartupTimer:
+    """Время запуска по этапам: от начала main.py до первого показанного кадра"""
+
     def __init__(self):
-        pygame.init()
-        pygame.mixer.init()
+        self.last = time.perf_counter()
+        # Импорты и всё, что было до создания игры (разбор аргументов, генерация уровня)
+        self.phases = [("imports", IMPORTED - STARTED), ("setup", self.last - IMPORTED)]
+        self.done = False
+
+    def mark(self, phase: str):
+        """Закрываем этап: его время — от предыдущей отметки"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self):
+        """Первый кадр показан — дальше этапы не пишем"""
+        self.mark("first frame")
+        self.done = True
+
+    def report(self) -> str:
+        lines = [f"{phase:<12} {seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"{'total':<12} {(self.last - STARTED) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+class ScreenPresenter:
+    """Вывод кадров на дисплей.
+
+    Игровой кадр меняется целиком и выводится через flip(). Статичные
+    экраны (меню, пауза, итоги) рисуются один раз и кэшируются; пока такой
+    экран на дисплее, перерисовываются только мелкие оверлеи (FPS,
+    профайлер), а на дисплей уходят лишь их прямоугольники.
+    """
+
+    def __init__(self, screen: pygame.Surface):
+        self.screen = screen
+        self.static = {}  # ключ экрана -> (версия, копия экрана)
+        self.shown = None  # ключ статичного экрана, который сейчас на дисплее
+        self.full = True  # Нужен полный flip
+        self.dirty = []
+        self.overlays = {}  # имя -> (ключ содержимого, занятый Rect)
+        self.drawn = set()
+
+    @property
+    def idle(self) -> bool:
+        """На дисплее статичный экран — цикл можно крутить медленнее"""
+        return self.shown is not None
+
+    def invalidate(self):
+        """Дисплей потерял содержимое (например, окно перекрыли) — следующий кадр выводим целиком"""
+        self.shown = None
+
+    def show_frame(self):
+        """Следующий кадр — игровой, рисуется заново и выводится целиком"""
+        self.shown = None
+        self.full = True
+
+    def show_static(self, key: str, draw, version=None):
+        """Статичный экран: draw() вызывается, только если экрана нет в кэше
+        или сменилась его версия (например, итоговый счёт)"""
+        cached = self.static.get(key)
+        if cached is not None and cached[0] == version:
+            if self.shown == key:
+                return
+            self.screen.blit(cached[1], (0, 0))
+        else:
+            draw()
+            self.static[key] = (version, self.screen.copy())
+        self.shown = key
+        self.full = True
+        self.overlays.clear()
+
+    def restore(self, rect: pygame.Rect):
+        """Возвращаем под оверлеем картинку статичного экрана"""
+        self.screen.blit(self.static[self.shown][1], rect, rect)
+        self.dirty.append(rect)
+
+    def overlay(self, name: str, draw, key=None):
+        """Оверлей поверх кадра: draw() рисует на экране и возвращает занятый Rect.
+
+        На статичном экране оверлей с тем же key не перерисовывается;
+        key=None — перерисовывать каждый кадр.
+        """
+        self.drawn.add(name)
+        previous = self.overlays.get(name)
+        if self.shown is not None and not self.full:
+            if previous is not None:
+                if key is not None and previous[0] == key:
+                    return
+                self.restore(previous[1])
+        rect = draw()
+        self.overlays[name] = (key, rect)
+        self.dirty.append(rect)
+
+    def present(self):
+        # Оверлеи, которые в этом кадре не рисовались, стираем
+        for name in list(self.overlays):
+            if name not in self.drawn:
+                if self.shown is not None and not self.full:
+                    self.restore(self.overlays[name][1])
+                del self.overlays[name]
+        self.drawn.clear()
+
+        if self.full:
+            pygame.display.flip()
+        elif self.dirty:
+            pygame.display.update(self.dirty)
+        self.full = False
+        self.dirty = []
+
+
+class InputRecorder:
+    """Запись ввода по тикам симуляции для детерминированного повтора.
+
+    Файл сжат gzip: первая строка — заголовок JSON (зерно, частота
+    симуляции, уровни), дальше записи RECORD по 8 байт: тик с вводом,
+    перезапуск уровня игроком и завершающая запись с хэшем состояния игры.
+    Уровни записываются путём относительно каталога игры и хэшем
+    содержимого, так что повтор в другой копии игры берёт её файлы и
+    отказывается играть уровень, отличающийся от записанного.
+    Сгенерированные уровни лежат в кэше, поэтому вместо пути для них
+    пишутся параметры генератора, и повтор генерирует уровень заново.
+    """
+
+    MAGIC = "doom-input"
+    VERSION = 3  # 1: уровни — абсолютные пути без хэша; 2: без параметров генератора
+    RECORD = struct.Struct("<BbbBf")  # тип, вперёд/уровень, вбок, огонь, поворот
+    TICK, LOAD, END = 0, 1, 2
+
+    def __init__(self, path: str, header: dict):
+        self.file = gzip.open(path, "wb")
+        header = dict(header, magic=self.MAGIC, version=self.VERSION)
+        self.file.write(json.dumps(header).encode() + b"\n")
+        self.ticks = 0
+
+    def tick(self, input_state: InputState):
+        self.file.write(self.RECORD.pack(self.TICK, input_state.forward, input_state.strafe,
+                                         bool(input_state.fire), input_state.turn))
+        self.ticks += 1
+
+    def load(self, level_num: int):
+        self.file.write(self.RECORD.pack(self.LOAD, level_num, 0, 0, 0.0))
+
+    def close(self, state_digest: bytes):
+        self.file.write(self.RECORD.pack(self.END, 0, 0, 0, 0.0) + state_digest)
+        self.file.close()
+
+    @staticmethod
+    def level_entry(path: str) -> dict:
+        """Уровень для заголовка: параметры генератора или путь (относительно каталога игры,
+        если файл в нём) и хэш"""
+        path = os.path.abspath(path)
+        try:
+            inside = os.path.commonpath([path, BASE_DIR]) == BASE_DIR
+        except ValueError:
+            inside = False  # Windows: уровень на другом диске
+        if inside:
+            path = os.path.relpath(path, BASE_DIR).replace(os.sep, "/")
+        with open(os.path.join(BASE_DIR, path), "rb") as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        generator = json.loads(source).get("generator")
+        if generator is not None:
+            return {"generate": generator, "sha256": digest}
+        return {"path": path, "sha256": digest}
+
+    @classmethod
+    def resolve_levels(cls, header: dict) -> List[str]:
+        """Пути уровней записи в этой копии игры (сгенерированные — генерируем заново);
+        проверяем, что уровни те же, что при записи"""
+        if header["version"] == 1:
+            return header["levels"]
+        paths = []
+        for entry in header["levels"]:
+            generator = entry.get("generate")
+            if generator is not None:
+                if generator["version"] != GENERATOR_VERSION:
+                    raise ValueError("уровень записи сгенерирован другой версией генератора")
+                path = generated_level_path(generator["width"], generator["height"], **generator["params"])
+                name = os.path.basename(path)
+            else:
+                path = os.path.join(BASE_DIR, entry["path"])
+                name = entry["path"]
+            try:
+                current = cls.level_entry(path)["sha256"]
+            except OSError:
+                raise ValueError(f"уровня записи {name} нет в этой копии игры") from None
+            if current != entry["sha256"]:
+                raise ValueError(f"уровень {name} отличается от записанного")
+            paths.append(path)
+        return paths
+
+    @classmethod
+    def read(cls, path: str) -> Tuple[dict, list, Optional[bytes]]:
+        """Заголовок, записи (TICK, InputState) / (LOAD, уровень) и хэш конечного состояния"""
+        try:
+            with gzip.open(path, "rb") as f:
+                header = json.loads(f.readline())
+                data = f.read()
+        except EOFError:
+            # Запись оборвалась (игру убили посреди сеанса) — конца gzip-потока нет
+            raise ValueError(f"{path}: запись обрезана") from None
+        if header.get("magic") != cls.MAGIC or header.get("version") not in (1, 2, cls.VERSION):
+            raise ValueError(f"{path}: не запись ввода или неподдерживаемая версия")
+
+        records = []
+        digest = None
+        size = cls.RECORD.size
+        for offset in range(0, len(data) - size + 1, size):
+            kind, forward, strafe, fire, turn = cls.RECORD.unpack_from(data, offset)
+            if kind == cls.TICK:
+                records.append((kind, InputState(forward, strafe, turn, bool(fire))))
+            elif kind == cls.LOAD:
+                records.append((kind, forward))
+            else:
+                digest = data[offset + size:]
+                break
+        return header, records, digest
+
+
+@dataclass
+class LoadedLevel:
+    """Уровень, собранный для игры: всё, что load_level присваивает игре"""
+    level: Level
+    walls: List[List[int]]
+    raycaster: RayCaster
+    player: Player
+    enemies: List[Enemy]
+    pickups: List[Pickup]
+    enemy_store: EnemyManager
+    flow_field: FlowField
+    pvs: VisibilitySets
+    enemy_grid: SpatialGrid
+    pickup_grid: SpatialGrid
+    minimap: Minimap
+
+
+class LevelPreloader:
+    """Сборка уровней в одном фоновом потоке.
+
+    request(n) ставит сборку уровня n в очередь, take(n) забирает результат:
+    готовый сразу, недостроенный — дождавшись его, а незапрошенный собирает
+    синхронно. Собранный уровень выдаётся один раз. build(n, progress)
+    сообщает долю готовности, её отдаёт status(n).
+
+    Поток — демон с наименьшим приоритетом: close() не ждёт сборку, а
+    отменяет её на ближайшем вызове progress (CancelledError), так что
+    выход из игры не зависает.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.worker = None
+        self.jobs = None
+        self.stopped = None
+        self.pending = {}
+        self.progress = {}
+
+    def request(self, level_num: int):
+        if level_num in self.pending:
+            return
+        if self.worker is None:
+            self.jobs = queue.SimpleQueue()
+            self.stopped = threading.Event()
+            self.worker = threading.Thread(target=self.work, args=(self.jobs, self.stopped),
+                                           name="level-preload", daemon=True)
+            self.worker.start()
+        future = Future()
+        self.progress[level_num] = 0.0
+        self.pending[level_num] = future
+        self.jobs.put((level_num, future))
+
+    def work(self, jobs: queue.SimpleQueue, stopped: threading.Event):
+        """Цикл фонового потока: собираем уровни по очереди до сигнала остановки"""
+        # Сборке — только простой главного потока: на одном ядре с равным приоритетом она
+        # удваивала время кадра. В Linux приоритет ставится на поток, а не на процесс
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            level_num, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            def report(fraction: float, level_num=level_num):
+                if stopped.is_set():
+                    raise CancelledError()
+                self.progress[level_num] = fraction
+
+            try:
+                future.set_result(self.build(level_num, report))
+            except Exception as error:
+                future.set_exception(error)
+
+    def status(self, level_num: int) -> Optional[float]:
+        """Доля готовности запрошенного уровня (1.0 — собран) или None, если он не запрошен"""
+        future = self.pending.get(level_num)
+        if future is None:
+            return None
+        return 1.0 if future.done() else self.progress.get(level_num, 0.0)
+
+    def take(self, level_num: int) -> LoadedLevel:
+        future = self.pending.pop(level_num, None)
+        self.progress.pop(level_num, None)
+        if future is None:
+            return self.build(level_num)
+        return future.result()
+
+    def close(self):
+        if self.worker is not None:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.progress.clear()
+            # Не ждём поток: идущая сборка бросит на ближайшем progress, и поток выйдет сам
+            self.stopped.set()
+            self.jobs.put(None)
+            self.worker = None
+
+
+class DoomGame:
+    def __init__(self, headless: bool = False, max_fps: int = MAX_FPS, profile_path: Optional[str] = None,
+                 sim_hz: int = SIM_HZ, levels: Optional[List[str]] = None, workers: int = RENDER_WORKERS,
+                 flat_divisor: int = FLAT_DIVISOR, resolution_scaler: Optional[ResolutionScaler] = None,
+                 seed: int = 0, record_path: Optional[str] = None, startup_report: bool = False,
+                 preload: bool = True):
+        self.startup = StartupTimer()
+        self.startup_report = startup_report
+        self.headless = headless
+        # Зерно случайных текстур: часть ключа кэша ассетов, пишется в запись ввода
+        self.seed = seed
+        self.max_fps = max_fps
+        self.sim_dt = 1 / sim_hz
+        self.sim_time = 0.0
+        self.sim_accumulator = 0.0
+        self.pending_turn = 0.0
+        # Доля шага симуляции, на которую рендер интерполирует позиции
+        self.alpha = 1.0
+        self.profiler = FrameProfiler(profile_path)
+        if headless:
+            # Без окна и звуковой карты: SDL рисует в память
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+        # Только видео: звук поднимается при выходе из меню, шрифты берутся из атласов
+        pygame.display.init()
+        self.audio_ready = False
 
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("DOOM - Python Edition")
         self.clock = pygame.time.Clock()
-        self.font = pygame.font.Font(None, 36)
-        self.big_font = pygame.font.Font(None, 72)
+        self.startup.mark("display")
+        self.assets = AssetCache()
+        self.font = GlyphAtlas.load(36, self.assets)
+        self.big_font = GlyphAtlas.load(72, self.assets)
+        self.startup.mark("fonts")
+        self.text_cache = TextCache()
+        self.hud = HudLayer(self.font, self.text_cache)
+        self.presenter = ScreenPresenter(self.screen)
 
         # Игровое состояние
-        self.game_state = "menu"  # menu, playing, paused, game_over, victory
+        self.game_state = "menu"  # menu, loading, playing, paused, game_over, victory
         self.current_level = 1
-        self.max_level = 3
-
-        # Инициализация уровня
-        self.load_level(self.current_level)
+        # Файлы уровней по порядку; по умолчанию — levels/level1.json, level2.json, ...
+        if levels is None:
+            levels = []
+            while os.path.exists(os.path.join(LEVELS_DIR, f"level{len(levels) + 1}.json")):
+                levels.append(os.path.join(LEVELS_DIR, f"level{len(levels) + 1}.json"))
+        self.levels = levels
+        self.max_level = len(levels)
+
+        # Уровень меню не нужен: он загружается, когда начинается игра (ensure_level)
+        self.level = None
+        # Следующий уровень собирается в фоне, чтобы переход на него был простой подменой
+        self.preload = preload
+        self.preloader = LevelPreloader(self.build_level)
+
+        # Сами текстуры рисуются быстрее, чем читаются с диска; таблицы освещения по ним — из кэша
+        wall_textures = self.create_wall_textures()
+        flat_textures = self.create_flat_textures()
+        self.startup.mark("textures")
+        self.colormaps = ColorMaps(wall_textures, self.screen, flats=flat_textures, cache=self.assets)
+        self.startup.mark("colormaps")
+        self.wall_renderer = WallRenderer(self.colormaps, self.screen)
+        self.flat_renderers = {}
+
+        # Разрешение: фиксированное или подстраиваемое под бюджет кадра
+        self.resolution_scaler = resolution_scaler
+        self.textured_flats = flat_divisor > 0
+        if resolution_scaler is None:
+            self.set_resolution(NUM_RAYS, flat_divisor)
+        else:
+            self.set_resolution(resolution_scaler.num_rays, resolution_scaler.flat_divisor)
+        self.render_pool = StripPool(workers)
+        self.sprite_atlas = SpriteAtlas(self.colormaps)
+        self.startup.mark("renderers")
+
+        # Запись ввода по тикам (--record)
+        self.recorder = None
+        if record_path:
+            self.recorder = InputRecorder(record_path, {
+                "seed": self.seed, "sim_hz": sim_hz,
+                "levels": [InputRecorder.level_entry(path) for path in self.levels]})
+
+        # Звуки создаются вместе с микшером в init_audio
+        self.sounds = {}
 
-        # Создаём текстуры стен
-        self.wall_textures = self.create_wall_textures()
+        # Первый уровень собирается, пока игрок в меню (на новой карте — вместе с PVS)
+        if self.preload and self.max_level:
+            self.preloader.request(self.current_level)
 
-        # Звуки
-        self.sounds = {}
+    def init_audio(self):
+        """Поднимаем микшер и звуки при первой надобности, а не при запуске"""
+        if self.audio_ready:
+            return
+        self.audio_ready = True
+        if not self.headless:
+            pygame.mixer.init()
         self.create_sounds()
 
+    def ensure_level(self):
+        """Загружаем текущий уровень, если он ещё не загружен"""
+        if self.level is None:
+            self.load_level(self.current_level)
+
     def create_sounds(self):
         """Создаём простые звуки программно"""
         # В реальной игре здесь загружались бы звуковые файлы
@@ -301,6 +2676,7 @@ class DoomGame:
         """Создаём простые текстуры стен"""
         textures = {}
         texture_size = 64
+        rng = random.Random(self.seed)
 
         # Текстура 1 - Кирпичи
         tex1 = pygame.Surface((texture_size, texture_size))
@@ -324,133 +2700,126 @@ class DoomGame:
         tex3 = pygame.Surface((texture_size, texture_size))
         tex3.fill((80, 80, 70))
         for _ in range(50):
-            x, y = random.randint(0, texture_size - 4), random.randint(0, texture_size - 4)
-            color = random.randint(60, 100)
+            x, y = rng.randint(0, texture_size - 4), rng.randint(0, texture_size - 4)
+            color = rng.randint(60, 100)
             pygame.draw.rect(tex3, (color, color, color - 10), (x, y, 4, 4))
         textures[3] = tex3
 
         return textures
 
+    def set_resolution(self, num_rays: int, flat_divisor: int):
+        """Число лучей (ширина внутреннего кадра) и делитель разрешения пола/потолка"""
+        self.num_rays = num_rays
+        self.flat_renderer = None
+        if self.textured_flats and flat_divisor:
+            if flat_divisor not in self.flat_renderers:
+                self.flat_renderers[flat_divisor] = FlatRenderer(self.colormaps, SCREEN_HEIGHT, flat_divisor)
+            self.flat_renderer = self.flat_renderers[flat_divisor]
+        self.profiler.set_counter("num_rays", num_rays)
+        self.profiler.set_counter("flat_divisor", flat_divisor if self.flat_renderer else 0)
+        if self.resolution_scaler is not None:
+            self.profiler.set_counter("resolution_step", self.resolution_scaler.step)
+
+    def end_frame(self, scale: bool = True):
+        """Закрываем кадр в профайлере и даём масштабированию разрешения его время.
+        scale=False — кадр меню, паузы или итогов: почти бесплатный, поэтому в бюджет
+        не идёт, иначе разрешение поднималось бы, пока игра стоит"""
+        profiler = self.profiler
+        profiler.end_frame()
+        scaler = self.resolution_scaler
+        if scale and scaler is not None and scaler.update(profiler.frame_index, profiler.last_total * 1000):
+            self.set_resolution(scaler.num_rays, scaler.flat_divisor)
+
+    def create_flat_textures(self) -> dict:
+        """Создаём текстуры пола и потолка"""
+        texture_size = 64
+
+        # Пол - каменная плитка
+        floor = pygame.Surface((texture_size, texture_size))
+        floor.fill(FLOOR_COLOR)
+        for y in range(0, texture_size, 32):
+            for x in range(0, texture_size, 32):
+                shade = 90 if (x + y) // 32 % 2 else 74
+                pygame.draw.rect(floor, (shade, shade, shade - 6), (x + 1, y + 1, 30, 30))
+        pygame.draw.line(floor, (60, 60, 55), (0, 0), (texture_size, 0))
+        pygame.draw.line(floor, (60, 60, 55), (0, 0), (0, texture_size))
+
+        # Потолок - панели
+        ceiling = pygame.Surface((texture_size, texture_size))
+        ceiling.fill(CEILING_COLOR)
+        pygame.draw.rect(ceiling, (40, 40, 45), (0, 0, texture_size, texture_size), 2)
+        pygame.draw.rect(ceiling, (58, 58, 62), (16, 16, 32, 32))
+
+        return {"floor": floor, "ceiling": ceiling}
+
     def load_level(self, level_num: int):
-        """Загружаем уровень"""
-        self.walls = self.get_level_map(level_num)
-        self.player = Player(1.5, 1.5)
-        self.enemies = []
-        self.pickups = []
+        """Загружаем уровень: собранный заранее в фоне или, если его нет, прямо сейчас"""
+        loaded = self.preloader.take(level_num)
+        self.level = loaded.level
+        self.walls = loaded.walls
+        self.raycaster = loaded.raycaster
+        self.player = loaded.player
+        self.enemies = loaded.enemies
+        self.pickups = loaded.pickups
         self.doors = []
+        self.enemy_store = loaded.enemy_store
+        self.flow_field = loaded.flow_field
+        self.pvs = loaded.pvs
+        self.enemy_grid = loaded.enemy_grid
+        self.pickup_grid = loaded.pickup_grid
+        self.minimap = loaded.minimap
+
+        # Следующий уровень собирается, пока играется этот
+        if self.preload and level_num < self.max_level:
+            self.preloader.request(level_num + 1)
+
+    def build_level(self, level_num: int, progress=None) -> LoadedLevel:
+        """Собираем уровень со всеми производными данными; вызывается и из фонового потока,
+        поэтому состояние игры не трогает. progress(доля) получает ход расчёта PVS"""
+        level = Level(self.level_path(level_num))
+        raycaster = RayCaster(level.grid)
 
         # Размещаем врагов и предметы
-        self.spawn_entities(level_num)
-
-    def get_level_map(self, level_num: int) -> List[List[int]]:
-        """Возвращает карту уровня"""
-        if level_num == 1:
-            return [
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 2, 2, 2, 0, 0, 0, 0, 3, 3, 3, 0, 0, 1],
-                [1, 0, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 1],
-                [1, 0, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 0, 3, 3, 3, 0, 0, 0, 0, 2, 2, 2, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-            ]
-        elif level_num == 2:
-            return [
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-                [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 1, 0, 0, 2, 2, 2, 2, 0, 0, 1, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 2, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 1, 1, 0, 0, 0, 0, 0, 2, 0, 0, 2, 0, 0, 0, 0, 0, 1, 1, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 3, 3, 3, 0, 0, 0, 0, 0, 0, 0, 0, 3, 3, 3, 0, 0, 1],
-                [1, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 1],
-                [1, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 1],
-                [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1],
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-            ]
-        else:  # level 3
-            return [
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 2, 2, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 2, 0, 0, 1],
-                [1, 0, 2, 0, 0, 0, 0, 3, 3, 3, 0, 0, 0, 0, 3, 3, 3, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 2, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 0, 2, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 2, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 2, 0, 0, 1],
-                [1, 0, 2, 2, 2, 0, 0, 3, 3, 3, 0, 0, 0, 0, 3, 3, 3, 0, 2, 2, 2, 0, 0, 1],
-                [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-                [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-            ]
-
-    def spawn_entities(self, level_num: int):
-        """Размещаем врагов и предметы на уровне"""
-        if level_num == 1:
-            # Враги
-            self.enemies = [
-                Enemy(5.5, 5.5, "imp"),
-                Enemy(10.5, 5.5, "imp"),
-                Enemy(7.5, 10.5, "demon"),
-                Enemy(12.5, 12.5, "imp"),
-            ]
-            # Предметы
-            self.pickups = [
-                Pickup(3.5, 8.5, "health"),
-                Pickup(12.5, 3.5, "ammo"),
-                Pickup(8.5, 13.5, "armor"),
-            ]
-        elif level_num == 2:
-            self.enemies = [
-                Enemy(5.5, 5.5, "demon"),
-                Enemy(14.5, 5.5, "demon"),
-                Enemy(10.5, 10.5, "imp"),
-                Enemy(5.5, 10.5, "imp"),
-                Enemy(14.5, 10.5, "imp"),
-                Enemy(10.5, 7.5, "baron"),
-            ]
-            self.pickups = [
-                Pickup(2.5, 2.5, "health"),
-                Pickup(17.5, 2.5, "ammo"),
-                Pickup(10.5, 14.5, "armor"),
-                Pickup(2.5, 13.5, "health"),
-                Pickup(17.5, 13.5, "ammo"),
-            ]
-        else:  # level 3
-            self.enemies = [
-                Enemy(5.5, 5.5, "baron"),
-                Enemy(18.5, 5.5, "baron"),
-                Enemy(12.5, 7.5, "demon"),
-                Enemy(5.5, 10.5, "demon"),
-                Enemy(18.5, 10.5, "demon"),
-                Enemy(8.5, 3.5, "imp"),
-                Enemy(15.5, 3.5, "imp"),
-                Enemy(8.5, 11.5, "imp"),
-                Enemy(15.5, 11.5, "imp"),
-            ]
-            self.pickups = [
-                Pickup(2.5, 2.5, "health"),
-                Pickup(21.5, 2.5, "health"),
-                Pickup(2.5, 11.5, "ammo"),
-                Pickup(21.5, 11.5, "ammo"),
-                Pickup(12.5, 2.5, "armor"),
-            ]
+        enemy_store, enemies, pickups = self.spawn_entities(level)
+
+        # Пространственные индексы живых врагов и несобранных предметов
+        enemy_grid = SpatialGrid()
+        for enemy in enemies:
+            if enemy.is_alive:
+                pos = enemy.pos
+                enemy_grid.insert(enemy, pos.x, pos.y)
+        pickup_grid = SpatialGrid()
+        for pickup in pickups:
+            if pickup.is_active:
+                pickup_grid.insert(pickup, pickup.pos.x, pickup.pos.y)
+
+        return LoadedLevel(
+            level=level,
+            walls=level.grid.tolist(),
+            raycaster=raycaster,
+            player=Player(*level.player_start),
+            enemies=enemies,
+            pickups=pickups,
+            enemy_store=enemy_store,
+            flow_field=FlowField(raycaster.grid, moves=level.moves),
+            # PVS считается при первой загрузке уровня и дальше берётся из кэша
+            pvs=VisibilitySets(level.array("pvs", lambda level: VisibilitySets.compile(level.grid,
+                                                                                       progress=progress))),
+            enemy_grid=enemy_grid,
+            pickup_grid=pickup_grid,
+            # Статичный слой мини-карты запекается один раз на уровень
+            minimap=Minimap(raycaster.grid),
+        )
+
+    def level_path(self, level_num: int) -> str:
+        return self.levels[level_num - 1]
+
+    def spawn_entities(self, level: Level) -> Tuple[EnemyManager, List[Enemy], List[Pickup]]:
+        """Враги уровня (сразу в общем хранилище) и предметы"""
+        enemy_store = EnemyManager(capacity=len(level.enemies))
+        enemies = enemy_store.spawn(level.enemies)
+        pickups = [Pickup(x, y, pickup_type) for x, y, pickup_type in level.pickups]
+        return enemy_store, enemies, pickups
 
     def cast_ray(self, angle: float) -> Tuple[float, int, float]:
         """Бросаем луч и возвращаем (расстояние, тип стены, позиция текстуры)"""
@@ -531,80 +2900,52 @@ class DoomGame:
 
     def render_3d(self):
         """Рендерим 3D вид"""
-        # Потолок и пол
-        pygame.draw.rect(self.screen, CEILING_COLOR, (0, 0, SCREEN_WIDTH, HALF_HEIGHT))
-        pygame.draw.rect(self.screen, FLOOR_COLOR, (0, HALF_HEIGHT, SCREEN_WIDTH, HALF_HEIGHT))
-
-        ray_angle = self.player.angle - HALF_FOV
-        z_buffer = []
-
-        for ray in range(NUM_RAYS):
-            depth, wall_type, offset = self.cast_ray(ray_angle)
-
-            # Убираем эффект рыбьего глаза
-            depth *= math.cos(self.player.angle - ray_angle)
-            z_buffer.append(depth)
-
-            # Высота стены
-            if depth > 0.001:
-                wall_height = int(SCREEN_HEIGHT / (depth + 0.0001))
-            else:
-                wall_height = SCREEN_HEIGHT
+        view_x, view_y, view_angle = self.player.view_pose(self.alpha)
+        ray_angles = RayCaster.ray_fan(view_angle, self.num_rays)
+        z_buffer = np.empty(len(ray_angles))
 
-            wall_height = min(wall_height, SCREEN_HEIGHT * 2)
+        # Потолок, пол и стены собираются в кадровом буфере полосами и выводятся разом
+        self.render_pool.run(self.render_strip, len(ray_angles), view_x, view_y, view_angle, ray_angles, z_buffer)
+        self.wall_renderer.present()
 
-            # Позиция стены на экране
-            wall_top = HALF_HEIGHT - wall_height // 2
-
-            # Получаем цвет/текстуру
-            is_horizontal = wall_type < 0
-            wall_type = abs(wall_type)
-
-            if wall_type in self.wall_textures:
-                texture = self.wall_textures[wall_type]
-                tex_x = int(offset * texture.get_width()) % texture.get_width()
-
-                # Вырезаем столбец текстуры
-                column = pygame.Surface((1, texture.get_height()))
-                column.blit(texture, (0, 0), (tex_x, 0, 1, texture.get_height()))
-
-                # Масштабируем
-                column = pygame.transform.scale(column, (SCALE, wall_height))
-
-                # Затемнение в зависимости от расстояния и ориентации
-                darkness = min(255, int(255 / (1 + depth * depth * 0.1)))
-                if is_horizontal:
-                    darkness = int(darkness * 0.8)
-
-                column.fill((darkness, darkness, darkness), special_flags=pygame.BLEND_MULT)
-
-                self.screen.blit(column, (ray * SCALE, wall_top))
-            else:
-                # Простой цвет если нет текстуры
-                color_val = max(50, min(200, int(200 / (1 + depth * 0.1))))
-                if is_horizontal:
-                    color_val = int(color_val * 0.8)
-                color = (color_val, color_val // 2, color_val // 2)
-                pygame.draw.rect(self.screen, color, (ray * SCALE, wall_top, SCALE, wall_height))
+        return z_buffer
 
-            ray_angle += DELTA_ANGLE
+    def render_strip(self, start: int, stop: int, view_x: float, view_y: float, view_angle: float,
+                     ray_angles: np.ndarray, z_buffer: np.ndarray):
+        """Лучи start..stop: бросаем и рисуем их столбцы в кадровый буфер"""
+        angles = ray_angles[start:stop]
+        depths, wall_types, horizontal, offsets = self.raycaster.cast(view_x, view_y, angles)
 
-        return z_buffer
+        # Убираем эффект рыбьего глаза
+        z_buffer[start:stop] = depths * np.cos(view_angle - angles)
+        flats = None
+        if self.flat_renderer is not None:
+            flats = self.flat_renderer.render(view_x, view_y, view_angle, ray_angles, start, stop - start)
+        self.wall_renderer.render(z_buffer[start:stop], wall_types, horizontal, offsets,
+                                  start, len(ray_angles), flats)
 
     def render_sprites(self, z_buffer: List[float]):
         """Рендерим спрайты врагов и предметов"""
         sprites = []
+        view_x, view_y, view_angle = self.player.view_pose(self.alpha)
+
+        # Берём из сетки только объекты в секторе обзора (с запасом на интерполяцию)
+        # и в кластерах, потенциально видимых из тайла камеры
+        view_radius = MAX_DEPTH + 1
+        view_half_angle = HALF_FOV + 0.5 + 0.1
 
         # Добавляем врагов
-        for enemy in self.enemies:
+        for enemy in self.enemy_grid.query_cone(view_x, view_y, view_angle, view_half_angle, view_radius,
+                                                self.pvs):
             if enemy.is_alive:
-                dx = enemy.pos.x - self.player.pos.x
-                dy = enemy.pos.y - self.player.pos.y
+                enemy_pos = enemy.prev_pos.lerp(enemy.pos, self.alpha)
+                dx = enemy_pos.x - view_x
+                dy = enemy_pos.y - view_y
                 distance = math.sqrt(dx * dx + dy * dy)
 
                 # Угол к врагу
                 theta = math.atan2(dy, dx)
-                gamma = theta - self.player.angle
+                gamma = theta - view_angle
 
                 # Нормализация угла
                 while gamma > math.pi:
@@ -621,14 +2962,15 @@ class DoomGame:
                     })
 
         # Добавляем предметы
-        for pickup in self.pickups:
+        for pickup in self.pickup_grid.query_cone(view_x, view_y, view_angle, view_half_angle, view_radius,
+                                                  self.pvs):
             if pickup.is_active:
-                dx = pickup.pos.x - self.player.pos.x
-                dy = pickup.pos.y - self.player.pos.y
+                dx = pickup.pos.x - view_x
+                dy = pickup.pos.y - view_y
                 distance = math.sqrt(dx * dx + dy * dy)
 
                 theta = math.atan2(dy, dx)
-                gamma = theta - self.player.angle
+                gamma = theta - view_angle
 
                 while gamma > math.pi:
                     gamma -= 2 * math.pi
@@ -646,7 +2988,9 @@ class DoomGame:
         # Сортируем по расстоянию (дальние сначала)
         sprites.sort(key=lambda x: x['distance'], reverse=True)
 
-        # Рендерим спрайты
+        # Рендерим спрайты: из кэша атласа, только видимые куски столбцов
+        atlas = self.sprite_atlas
+        column_width = SCREEN_WIDTH // len(z_buffer)
         for sprite_data in sprites:
             distance = sprite_data['distance']
             gamma = sprite_data['angle']
@@ -660,63 +3004,42 @@ class DoomGame:
 
             if sprite_data['type'] == 'enemy':
                 enemy = sprite_data['obj']
-                sprite_width = int(sprite_height * enemy.size)
-
-                # Проверяем z-buffer
-                ray_index = int(screen_x / SCALE)
-                if 0 <= ray_index < len(z_buffer):
-                    if distance < z_buffer[ray_index]:
-                        # Рисуем врага
-                        sprite_top = HALF_HEIGHT - sprite_height // 2
-                        sprite_left = screen_x - sprite_width // 2
-
-                        # Тело врага
-                        body_rect = pygame.Rect(sprite_left, sprite_top, sprite_width, sprite_height)
-
-                        # Затемнение по расстоянию
-                        darkness = max(0.3, min(1.0, 1 - distance / MAX_DEPTH))
-                        color = tuple(int(c * darkness) for c in enemy.color)
-
-                        pygame.draw.ellipse(self.screen, color, body_rect)
-
-                        # Глаза
-                        eye_y = sprite_top + sprite_height // 4
-                        eye_size = max(2, sprite_width // 6)
-                        pygame.draw.circle(self.screen, (255, 255, 0),
-                                           (sprite_left + sprite_width // 3, eye_y), eye_size)
-                        pygame.draw.circle(self.screen, (255, 255, 0),
-                                           (sprite_left + 2 * sprite_width // 3, eye_y), eye_size)
-
-                        # Индикатор здоровья
-                        if enemy.health < enemy.max_health:
-                            health_bar_width = sprite_width
-                            health_bar_height = 4
-                            health_ratio = enemy.health / enemy.max_health
-
-                            pygame.draw.rect(self.screen, RED,
-                                             (sprite_left, sprite_top - 8, health_bar_width, health_bar_height))
-                            pygame.draw.rect(self.screen, GREEN,
-                                             (sprite_left, sprite_top - 8, int(health_bar_width * health_ratio),
-                                              health_bar_height))
-
-            elif sprite_data['type'] == 'pickup':
-                pickup = sprite_data['obj']
-                sprite_width = int(sprite_height * pickup.size * 2)
-
-                ray_index = int(screen_x / SCALE)
-                if 0 <= ray_index < len(z_buffer):
-                    if distance < z_buffer[ray_index]:
-                        sprite_top = HALF_HEIGHT - sprite_height // 4
-                        sprite_left = screen_x - sprite_width // 2
-
-                        darkness = max(0.3, min(1.0, 1 - distance / MAX_DEPTH))
-                        color = tuple(int(c * darkness) for c in pickup.color)
-
-                        # Рисуем предмет
-                        pickup_rect = pygame.Rect(sprite_left, sprite_top,
-                                                  sprite_width, sprite_height // 2)
-                        pygame.draw.rect(self.screen, color, pickup_rect)
-                        pygame.draw.rect(self.screen, WHITE, pickup_rect, 2)
+                frame = ("enemy", enemy.enemy_type, enemy.animation_frame)
+            else:
+                frame = ("pickup", sprite_data['obj'].pickup_type, 0)
+            width, height = atlas.size(*frame, sprite_height)
+            left, top = screen_x - width // 2, HALF_HEIGHT - height // 2
+
+            # Столбцы z-буфера под спрайтом: видимые — там, где стена дальше
+            # спрайта (глубина спрайта — вдоль взгляда, как и у z-буфера)
+            first = max(left // column_width, 0)
+            last = min((left + width - 1) // column_width + 1, len(z_buffer))
+            if first >= last:
+                continue
+            visible = z_buffer[first:last] > distance * math.cos(gamma)
+            if not visible.any():
+                continue  # Полностью скрыт — даже не масштабируем
+
+            # Непрерывные видимые отрезки: границы, где маска меняется
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], visible, [False]))))
+            spans = []
+            for start, stop in zip(edges[::2].tolist(), edges[1::2].tolist()):
+                span_left = max((first + start) * column_width, left)
+                span_right = min((first + stop) * column_width, left + width)
+                spans.append((span_left, span_right))
+
+            image = atlas.get(*frame, sprite_height, distance)
+            for span_left, span_right in spans:
+                self.screen.blit(image, (span_left, top), (span_left - left, 0, span_right - span_left, height))
+
+            # Индикатор здоровья — тоже только над видимыми отрезками
+            if sprite_data['type'] == 'enemy' and enemy.health < enemy.max_health:
+                health_right = left + int(width * enemy.health / enemy.max_health)
+                for span_left, span_right in spans:
+                    pygame.draw.rect(self.screen, RED, (span_left, top - 8, span_right - span_left, 4))
+                    green_right = min(span_right, health_right)
+                    if green_right > span_left:
+                        pygame.draw.rect(self.screen, GREEN, (span_left, top - 8, green_right - span_left, 4))
 
     def render_weapon(self):
         """Рендерим оружие"""
@@ -762,94 +3085,21 @@ class DoomGame:
 
     def render_hud(self):
         """Рендерим интерфейс"""
-        # Фон HUD
-        hud_height = 80
-        hud_surface = pygame.Surface((SCREEN_WIDTH, hud_height))
-        hud_surface.fill((40, 40, 40))
-        hud_surface.set_alpha(200)
-        self.screen.blit(hud_surface, (0, SCREEN_HEIGHT - hud_height))
-
-        # Здоровье
-        health_text = self.font.render(f"HEALTH: {self.player.health}", True, RED)
-        self.screen.blit(health_text, (20, SCREEN_HEIGHT - 70))
-
-        # Полоска здоровья
-        pygame.draw.rect(self.screen, (100, 0, 0), (20, SCREEN_HEIGHT - 40, 150, 20))
-        health_width = int(150 * (self.player.health / self.player.max_health))
-        pygame.draw.rect(self.screen, RED, (20, SCREEN_HEIGHT - 40, health_width, 20))
-        pygame.draw.rect(self.screen, WHITE, (20, SCREEN_HEIGHT - 40, 150, 20), 2)
-
-        # Броня
-        armor_text = self.font.render(f"ARMOR: {self.player.armor}", True, BLUE)
-        self.screen.blit(armor_text, (200, SCREEN_HEIGHT - 70))
-
-        # Полоска брони
-        pygame.draw.rect(self.screen, (0, 0, 100), (200, SCREEN_HEIGHT - 40, 150, 20))
-        armor_width = int(150 * (self.player.armor / self.player.max_armor))
-        pygame.draw.rect(self.screen, BLUE, (200, SCREEN_HEIGHT - 40, armor_width, 20))
-        pygame.draw.rect(self.screen, WHITE, (200, SCREEN_HEIGHT - 40, 150, 20), 2)
-
-        # Патроны
-        ammo_text = self.font.render(f"AMMO: {self.player.weapon.ammo}/{self.player.weapon.max_ammo}", True, YELLOW)
-        self.screen.blit(ammo_text, (400, SCREEN_HEIGHT - 55))
-
-        # Счёт
-        score_text = self.font.render(f"SCORE: {self.player.score}", True, WHITE)
-        self.screen.blit(score_text, (SCREEN_WIDTH - 200, SCREEN_HEIGHT - 70))
-
-        # Уровень
-        level_text = self.font.render(f"LEVEL: {self.current_level}", True, WHITE)
-        self.screen.blit(level_text, (SCREEN_WIDTH - 200, SCREEN_HEIGHT - 40))
-
-        # Враги
-        enemies_alive = len([e for e in self.enemies if e.is_alive])
-        enemies_text = self.font.render(f"ENEMIES: {enemies_alive}", True, RED)
-        self.screen.blit(enemies_text, (SCREEN_WIDTH - 400, SCREEN_HEIGHT - 55))
+        player = self.player
+        self.hud.update({
+            "health": (player.health, player.max_health),
+            "armor": (player.armor, player.max_armor),
+            "ammo": (player.weapon.ammo, player.weapon.max_ammo),
+            "score": player.score,
+            "level": self.current_level,
+            "enemies": self.enemy_store.alive_count,
+        })
+        self.hud.render(self.screen)
 
     def render_minimap(self):
         """Рендерим мини-карту"""
-        map_scale = 8
-        map_offset_x = 10
-        map_offset_y = 10
-
-        # Фон карты
-        map_width = len(self.walls[0]) * map_scale
-        map_height = len(self.walls) * map_scale
-        map_surface = pygame.Surface((map_width, map_height))
-        map_surface.fill((0, 0, 0))
-        map_surface.set_alpha(180)
-
-        # Рисуем стены
-        for y, row in enumerate(self.walls):
-            for x, cell in enumerate(row):
-                if cell > 0:
-                    color = (100, 100, 100) if cell == 1 else (80, 80, 100) if cell == 2 else (100, 80, 80)
-                    pygame.draw.rect(map_surface, color,
-                                     (x * map_scale, y * map_scale, map_scale - 1, map_scale - 1))
-
-        # Рисуем врагов
-        for enemy in self.enemies:
-            if enemy.is_alive:
-                pygame.draw.circle(map_surface, enemy.color,
-                                   (int(enemy.pos.x * map_scale), int(enemy.pos.y * map_scale)), 3)
-
-        # Рисуем предметы
-        for pickup in self.pickups:
-            if pickup.is_active:
-                pygame.draw.circle(map_surface, pickup.color,
-                                   (int(pickup.pos.x * map_scale), int(pickup.pos.y * map_scale)), 2)
-
-        # Рисуем игрока
-        player_x = int(self.player.pos.x * map_scale)
-        player_y = int(self.player.pos.y * map_scale)
-        pygame.draw.circle(map_surface, GREEN, (player_x, player_y), 3)
-
-        # Направление взгляда
-        look_x = player_x + int(math.cos(self.player.angle) * 10)
-        look_y = player_y + int(math.sin(self.player.angle) * 10)
-        pygame.draw.line(map_surface, GREEN, (player_x, player_y), (look_x, look_y), 2)
-
-        self.screen.blit(map_surface, (map_offset_x, map_offset_y))
+        self.minimap.render(self.screen, (10, 10), self.player.view_pose(self.alpha),
+                            self.enemy_grid, self.pickup_grid, self.alpha)
 
     def render_menu(self):
         """Рендерим главное меню"""
@@ -882,6 +3132,23 @@ class DoomGame:
             text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, 320 + i * 35))
             self.screen.blit(text, text_rect)
 
+    def render_loading(self, percent: int):
+        """Рендерим экран загрузки уровня с долей готовности"""
+        self.screen.fill(BLACK)
+
+        title = self.big_font.render("LOADING", True, WHITE)
+        title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50))
+        self.screen.blit(title, title_rect)
+
+        # Полоса прогресса
+        bar = pygame.Rect(SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2 + 10, SCREEN_WIDTH // 2, 20)
+        pygame.draw.rect(self.screen, DARK_GRAY, bar)
+        pygame.draw.rect(self.screen, RED, (bar.x, bar.y, bar.width * percent // 100, bar.height))
+
+        percent_text = self.font.render(f"{percent}%", True, LIGHT_GRAY)
+        percent_rect = percent_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 70))
+        self.screen.blit(percent_text, percent_rect)
+
     def render_pause(self):
         """Рендерим меню паузы"""
         # Затемнение
@@ -903,6 +3170,15 @@ class DoomGame:
         menu_rect = menu_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 60))
         self.screen.blit(menu_text, menu_rect)
 
+    def render_paused(self):
+        """Последний игровой кадр под меню паузы"""
+        profiler = self.profiler
+        z_buffer = profiler.call("render_3d", self.render_3d)
+        profiler.call("render_sprites", self.render_sprites, z_buffer)
+        profiler.call("render_weapon", self.render_weapon)
+        profiler.call("render_hud", self.render_hud)
+        profiler.call("render_screen", self.render_pause)
+
     def render_game_over(self):
         """Рендерим экран поражения"""
         self.screen.fill((50, 0, 0))
@@ -938,11 +3214,15 @@ class DoomGame:
     def handle_shooting(self, current_time: float):
         """Обработка стрельбы"""
         if self.player.weapon.fire(current_time):
-            # Проверяем попадание по врагам
-            for enemy in self.enemies:
-                if not enemy.is_alive:
-                    continue
+            hit_tolerance = 0.3  # Радиус попадания
+            candidates = self.enemy_grid.query_cone(self.player.pos.x, self.player.pos.y,
+                                                    self.player.angle, hit_tolerance, SHOT_RANGE, self.pvs)
+            # Порядок проверки — как в списке врагов
+            candidates.sort(key=lambda e: e._index)
 
+            # Проверяем попадание по врагам
+            targets = []
+            for enemy in candidates:
                 # Вычисляем угол к врагу
                 dx = enemy.pos.x - self.player.pos.x
                 dy = enemy.pos.y - self.player.pos.y
@@ -958,49 +3238,36 @@ class DoomGame:
                     gamma += 2 * math.pi
 
                 # Проверяем попадание (в центре экрана)
-                hit_tolerance = 0.3  # Радиус попадания
-                if abs(gamma) < hit_tolerance and distance < 15:
-                    # Проверяем, нет ли стены между игроком и врагом
-                    if not self.is_wall_between(self.player.pos, enemy.pos):
-                        killed = enemy.take_damage(self.player.weapon.damage)
-                        if killed:
-                            self.player.score += 100
-                            self.player.kills += 1
-                        break  # Попадаем только в одного врага
+                if abs(gamma) < hit_tolerance and distance < SHOT_RANGE:
+                    targets.append(enemy)
+
+            if not targets:
+                return
+
+            # Проверяем, нет ли стены между игроком и врагами — одним запросом
+            blocked = self.raycaster.segments_blocked(
+                self.player.pos.x, self.player.pos.y,
+                [enemy.pos.x for enemy in targets], [enemy.pos.y for enemy in targets])
+            for enemy, is_blocked in zip(targets, blocked.tolist()):
+                if not is_blocked:
+                    killed = enemy.take_damage(self.player.weapon.damage)
+                    if killed:
+                        self.enemy_grid.remove(enemy)
+                        self.player.score += 100
+                        self.player.kills += 1
+                    break  # Попадаем только в одного врага
 
     def is_wall_between(self, pos1: Vector2, pos2: Vector2) -> bool:
         """Проверяет, есть ли стена между двумя точками"""
-        dx = pos2.x - pos1.x
-        dy = pos2.y - pos1.y
-        distance = math.sqrt(dx * dx + dy * dy)
-
-        if distance == 0:
-            return False
-
-        steps = int(distance * 10)
-        for i in range(steps):
-            t = i / steps
-            check_x = pos1.x + dx * t
-            check_y = pos1.y + dy * t
-
-            map_x = int(check_x)
-            map_y = int(check_y)
-
-            if 0 <= map_x < len(self.walls[0]) and 0 <= map_y < len(self.walls):
-                if self.walls[map_y][map_x] > 0:
-                    return True
-
-        return False
+        return self.raycaster.segment_blocked(pos1.x, pos1.y, pos2.x, pos2.y)
 
     def check_pickups(self):
         """Проверяем подбор предметов"""
-        for pickup in self.pickups:
-            if not pickup.is_active:
-                continue
-
+        for pickup in self.pickup_grid.query_radius(self.player.pos.x, self.player.pos.y, PICKUP_RADIUS):
             distance = self.player.pos.distance_to(pickup.pos)
-            if distance < 0.5:
+            if distance < PICKUP_RADIUS:
                 pickup.is_active = False
+                self.pickup_grid.remove(pickup)
 
                 if pickup.pickup_type == "health":
                     self.player.heal(pickup.value)
@@ -1014,19 +3281,25 @@ class DoomGame:
 
     def update_enemies(self, delta_time: float, current_time: float):
         """Обновляем врагов"""
-        for enemy in self.enemies:
-            enemy.update(self.player.pos, self.walls, delta_time, current_time)
-
-            # Проверяем атаку
-            if enemy.can_attack(self.player.pos, current_time):
-                damage = enemy.attack(current_time)
-                if self.player.take_damage(damage):
-                    self.game_state = "game_over"
+        store = self.enemy_store
+        self.flow_field.update(self.player.pos.x, self.player.pos.y)
+        attackers, relocated = store.update(self.player.pos, self.raycaster.grid, delta_time, current_time,
+                                            self.flow_field)
+
+        # Переносим в сетке только сменивших тайл
+        views = store.views
+        for i in relocated.tolist():
+            self.enemy_grid.move(views[i], store.x[i], store.y[i])
+
+        # Атаки — по очереди, как если бы враги обновлялись по одному
+        for i in attackers.tolist():
+            store.last_attack[i] = current_time
+            if self.player.take_damage(int(store.damage[i])):
+                self.game_state = "game_over"
 
     def check_level_complete(self):
         """Проверяем, завершён ли уровень"""
-        enemies_alive = len([e for e in self.enemies if e.is_alive])
-        if enemies_alive == 0:
+        if self.enemy_store.alive_count == 0:
             if self.current_level < self.max_level:
                 self.current_level += 1
                 self.load_level(self.current_level)
@@ -1034,58 +3307,237 @@ class DoomGame:
             else:
                 self.game_state = "victory"
 
-    def handle_input(self, delta_time: float):
-        """Обработка ввода"""
+    def sample_input(self) -> InputState:
+        """Считываем клавиатуру и мышь"""
         keys = pygame.key.get_pressed()
-
-        # Движение
-        forward = 0
-        strafe = 0
+        input_state = InputState()
 
         if keys[pygame.K_w]:
-            forward = 1
+            input_state.forward = 1
         if keys[pygame.K_s]:
-            forward = -1
+            input_state.forward = -1
         if keys[pygame.K_a]:
-            strafe = -1
+            input_state.strafe = -1
         if keys[pygame.K_d]:
-            strafe = 1
+            input_state.strafe = 1
+
+        # Смещение мыши копится, пока его не заберёт шаг симуляции
+        self.pending_turn += pygame.mouse.get_rel()[0]
+        input_state.turn = self.pending_turn
 
-        if forward != 0 or strafe != 0:
-            self.player.move(forward, strafe, self.walls, delta_time)
+        input_state.fire = pygame.mouse.get_pressed()[0]  # Левая кнопка мыши
+        return input_state
+
+    def handle_input(self, input_state: InputState, delta_time: float, current_time: float):
+        """Обработка ввода"""
+        # Движение
+        if input_state.forward != 0 or input_state.strafe != 0:
+            self.player.move(input_state.forward, input_state.strafe, self.walls, delta_time)
 
         # Поворот мышью
-        mouse_rel = pygame.mouse.get_rel()
-        if mouse_rel[0] != 0:
-            self.player.rotate(mouse_rel[0] * 0.002, 1)
+        if input_state.turn != 0:
+            self.player.rotate(input_state.turn * MOUSE_SENSITIVITY, 1)
 
         # Стрельба
-        mouse_buttons = pygame.mouse.get_pressed()
-        if mouse_buttons[0]:  # Левая кнопка мыши
-            current_time = pygame.time.get_ticks() / 1000
+        if input_state.fire:
             self.handle_shooting(current_time)
 
+    def sim_step(self, input_state: InputState):
+        """Один шаг симуляции фиксированной длины sim_dt"""
+        profiler = self.profiler
+        self.sim_time += self.sim_dt
+        if self.recorder is not None:
+            self.recorder.tick(input_state)
+
+        self.player.save_pose()
+        self.enemy_store.save_positions()
+
+        profiler.call("handle_input", self.handle_input, input_state, self.sim_dt, self.sim_time)
+        self.player.weapon.update(self.sim_time)
+        profiler.call("update_enemies", self.update_enemies, self.sim_dt, self.sim_time)
+        profiler.call("check_pickups", self.check_pickups)
+        profiler.call("check_level_complete", self.check_level_complete)
+
+    def advance_simulation(self, delta_time: float, input_state: InputState):
+        """Прогоняем столько шагов симуляции, сколько накопилось реального времени"""
+        self.sim_accumulator += delta_time
+        steps = 0
+        while self.sim_accumulator >= self.sim_dt and self.game_state == "playing":
+            if steps == MAX_SIM_STEPS:
+                # Не догоняем отставание, а отбрасываем его
+                self.sim_accumulator = 0.0
+                break
+            self.sim_step(input_state)
+            self.sim_accumulator -= self.sim_dt
+            steps += 1
+
+            # Поворот мышью применяется только в первом шаге
+            input_state.turn = 0.0
+            self.pending_turn = 0.0
+
+        self.alpha = self.sim_accumulator / self.sim_dt
+
+    def step_simulation(self, steps: int, input_state: Optional[InputState] = None):
+        """Прогоняем steps шагов симуляции без рендеринга и без оглядки на реальное время"""
+        self.ensure_level()
+        input_state = input_state or InputState()
+        for _ in range(steps):
+            if self.game_state != "playing":
+                break
+            self.sim_step(input_state)
+        self.alpha = 1.0
+
+    def render_frame(self):
+        """Рендерим игровой кадр целиком"""
+        profiler = self.profiler
+        z_buffer = profiler.call("render_3d", self.render_3d)
+        profiler.call("render_sprites", self.render_sprites, z_buffer)
+        profiler.call("render_weapon", self.render_weapon)
+        profiler.call("render_hud", self.render_hud)
+        profiler.call("render_minimap", self.render_minimap)
+
+    def restart(self, level_num: int = 1):
+        """Перезапуск с уровня по команде игрока (в записи ввода — отдельной записью)"""
+        self.current_level = level_num
+        self.load_level(level_num)
+        if self.recorder is not None:
+            self.recorder.load(level_num)
+
+    def state_digest(self) -> bytes:
+        """Хэш игрового состояния: совпадает у записи и её повтора на той же сборке"""
+        self.ensure_level()
+        digest = hashlib.sha256()
+        player = self.player
+        digest.update(struct.pack("<4d6i", player.pos.x, player.pos.y, player.angle, self.sim_time,
+                                  player.health, player.armor, player.score, player.kills,
+                                  player.weapon.ammo, self.current_level))
+        store = self.enemy_store
+        for name in EnemyManager.FIELDS:
+            digest.update(getattr(store, name)[:store.count].tobytes())
+        digest.update(bytes(pickup.is_active for pickup in self.pickups))
+        return digest.digest()
+
+    def run_replay(self, records: list, recorded_digest: Optional[bytes] = None) -> dict:
+        """Повторяем запись ввода тик за тиком: кадр на тик, с ограничением FPS или без"""
+        self.ensure_level()
+        self.game_state = "playing"
+        profiler = self.profiler
+        frame_times = []
+        for kind, value in records:
+            if kind == InputRecorder.LOAD:
+                self.restart(value)
+                self.game_state = "playing"
+                continue
+
+            if self.max_fps:
+                self.clock.tick(self.max_fps)
+            start = time.perf_counter()
+            profiler.begin_frame()
+            if self.game_state == "playing":
+                self.sim_step(value)
+            self.alpha = 1.0
+            self.render_frame()
+            profiler.call("present", pygame.display.flip)
+            pygame.event.pump()
+            frame_times.append(time.perf_counter() - start)
+            self.end_frame()
+
+        digest = self.state_digest()
+        times_ms = np.array(frame_times or [0.0]) * 1000
+        return {
+            "ticks": len(frame_times),
+            "mean_ms": float(times_ms.mean()),
+            "p50_ms": float(np.percentile(times_ms, 50)),
+            "p99_ms": float(np.percentile(times_ms, 99)),
+            "max_ms": float(times_ms.max()),
+            "digest": digest.hex(),
+            "matches": None if recorded_digest is None else digest == recorded_digest,
+        }
+
+    def scripted_path(self, frames: int):
+        """Маршрут камеры для бенчмарка: обход всех свободных клеток змейкой с вращением"""
+        cells = []
+        for y, row in enumerate(self.walls):
+            xs = [x for x, cell in enumerate(row) if cell == 0]
+            cells.extend((x, y) for x in (xs if y % 2 == 0 else reversed(xs)))
+
+        for frame in range(frames):
+            x, y = cells[frame * len(cells) // frames]
+            angle = (frame * 2 * math.pi / 90) % (2 * math.pi)
+            yield x + 0.5, y + 0.5, angle
+
+    def run_benchmark(self, frames: int = BENCHMARK_FRAMES) -> dict:
+        """Прогоняем камеру по каждому уровню без ограничения FPS и меряем время кадров"""
+        results = {}
+        self.game_state = "playing"
+
+        for level_num in range(1, self.max_level + 1):
+            self.current_level = level_num
+            self.load_level(level_num)
+            self.player.god_mode = True
+
+            frame_times = []
+            for x, y, angle in self.scripted_path(frames):
+                start = time.perf_counter()
+                self.profiler.begin_frame()
+
+                self.player.pos.x, self.player.pos.y, self.player.angle = x, y, angle
+                self.step_simulation(1)
+                self.render_frame()
+                self.profiler.call("present", pygame.display.flip)
+                pygame.event.pump()
+
+                frame_times.append(time.perf_counter() - start)
+                self.end_frame()
+
+            times_ms = np.array(frame_times) * 1000
+            results[level_num] = {
+                "frames": frames,
+                "fps": frames / times_ms.sum() * 1000,
+                "mean_ms": float(times_ms.mean()),
+                "p50_ms": float(np.percentile(times_ms, 50)),
+                "p90_ms": float(np.percentile(times_ms, 90)),
+                "p99_ms": float(np.percentile(times_ms, 99)),
+                "max_ms": float(times_ms.max()),
+                "rays": self.num_rays,
+            }
+
+        return results
+
     def run(self):
         """Главный игровой цикл"""
         running = True
         pygame.mouse.set_visible(False)
         pygame.event.set_grab(True)
 
+        profiler = self.profiler
+        presenter = self.presenter
         while running:
-            delta_time = self.clock.tick(60) / 1000
-            current_time = pygame.time.get_ticks() / 1000
+            # Статичный экран не меняется — незачем крутить цикл на полной частоте
+            fps_cap = min(self.max_fps or IDLE_FPS, IDLE_FPS) if presenter.idle else self.max_fps
+            if not self.startup.done:
+                # Первый кадр показываем сразу, не выжидая интервал ограничения FPS
+                fps_cap = 0
+            delta_time = self.clock.tick(fps_cap) / 1000
+            profiler.begin_frame()
 
             # Обработка событий
+            events_start = time.perf_counter()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
 
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    presenter.invalidate()
+
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    profiler.show_overlay = not profiler.show_overlay
+
                 elif event.type == pygame.KEYDOWN:
                     if self.game_state == "menu":
                         if event.key == pygame.K_RETURN:
-                            self.game_state = "playing"
-                            pygame.mouse.set_visible(False)
-                            pygame.event.set_grab(True)
+                            # Пока уровень собирается в фоне, показываем экран загрузки
+                            self.game_state = "loading"
                         elif event.key == pygame.K_q:
                             running = False
 
@@ -1102,68 +3554,212 @@ class DoomGame:
                             pygame.event.set_grab(True)
                         elif event.key == pygame.K_m:
                             self.game_state = "menu"
-                            self.current_level = 1
-                            self.load_level(1)
+                            self.restart()
 
                     elif self.game_state in ["game_over", "victory"]:
                         if event.key == pygame.K_r:
-                            self.current_level = 1
-                            self.load_level(1)
+                            self.restart()
                             self.game_state = "playing"
                             pygame.mouse.set_visible(False)
                             pygame.event.set_grab(True)
                         elif event.key == pygame.K_m:
                             self.game_state = "menu"
-                            self.current_level = 1
-                            self.load_level(1)
+                            self.restart()
+            profiler.record("events", events_start)
 
             # Обновление и рендеринг
+            played = self.game_state == "playing"
             if self.game_state == "menu":
-                self.render_menu()
+                profiler.call("render_screen", presenter.show_static, "menu", self.render_menu)
                 pygame.mouse.set_visible(True)
                 pygame.event.set_grab(False)
 
+            elif self.game_state == "loading":
+                progress = self.preloader.status(self.current_level) if self.level is None else 1.0
+                if progress is None or progress >= 1.0:
+                    self.ensure_level()
+                    self.init_audio()
+                    self.game_state = "playing"
+                    pygame.mouse.set_visible(False)
+                    pygame.event.set_grab(True)
+                else:
+                    percent = int(progress * 100)
+                    profiler.call("render_screen", presenter.show_static, "loading",
+                                  lambda: self.render_loading(percent), percent)
+
             elif self.game_state == "playing":
-                # Обновление
-                self.handle_input(delta_time)
-                self.player.weapon.update(current_time)
-                self.update_enemies(delta_time, current_time)
-                self.check_pickups()
-                self.check_level_complete()
+                # Обновление с фиксированным шагом
+                self.advance_simulation(delta_time, self.sample_input())
 
                 # Рендеринг
-                z_buffer = self.render_3d()
-                self.render_sprites(z_buffer)
-                self.render_weapon()
-                self.render_hud()
-                self.render_minimap()
+                presenter.show_frame()
+                self.render_frame()
 
             elif self.game_state == "paused":
-                z_buffer = self.render_3d()
-                self.render_sprites(z_buffer)
-                self.render_weapon()
-                self.render_hud()
-                self.render_pause()
+                # Кадр под паузой остаётся верен, пока симуляция не сделала шаг
+                presenter.show_static("paused", self.render_paused, self.sim_time)
 
             elif self.game_state == "game_over":
-                self.render_game_over()
+                profiler.call("render_screen", presenter.show_static, "game_over", self.render_game_over,
+                              self.player.score)
                 pygame.mouse.set_visible(True)
                 pygame.event.set_grab(False)
 
             elif self.game_state == "victory":
-                self.render_victory()
+                profiler.call("render_screen", presenter.show_static, "victory", self.render_victory,
+                              self.player.score)
                 pygame.mouse.set_visible(True)
                 pygame.event.set_grab(False)
 
             # FPS
-            fps_text = self.font.render(f"FPS: {int(self.clock.get_fps())}", True, WHITE)
-            self.screen.blit(fps_text, (SCREEN_WIDTH - 100, 10))
+            fps_label = f"FPS: {int(self.clock.get_fps())}"
+            fps_text = self.text_cache.render(self.font, fps_label, WHITE)
+            presenter.overlay("fps", lambda: self.screen.blit(fps_text, (SCREEN_WIDTH - 100, 10)), fps_label)
+
+            if profiler.show_overlay:
+                presenter.overlay("profiler", lambda: profiler.render_overlay(self.screen))
+
+            profiler.call("present", presenter.present)
+            self.end_frame(scale=played)
+
+            if not self.startup.done:
+                self.startup.finish()
+                if self.startup_report:
+                    print(self.startup.report())
+                    # Без окна игра ни к чему — это был только замер запуска
+                    running = not self.headless
+
+        profiler.close()
+        self.render_pool.close()
+        self.preloader.close()
+        if self.recorder is not None:
+            self.recorder.close(self.state_digest())
+        pygame.quit()
 
-            pygame.display.flip()
 
+def print_benchmark(results: dict):
+    """Печатаем таблицу результатов бенчмарка"""
+    print(f"{'level':>5} {'frames':>6} {'fps':>8} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'rays':>5}")
+    for level_num, stats in results.items():
+        print(f"{level_num:>5} {stats['frames']:>6} {stats['fps']:>8.1f} {stats['mean_ms']:>8.2f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f} "
+              f"{stats['rays']:>5}")
+    print("(frame times in ms)")
+
+
+def print_replay(result: dict):
+    """Печатаем итог повтора записи ввода"""
+    print(f"ticks {result['ticks']}, mean {result['mean_ms']:.2f} ms, p50 {result['p50_ms']:.2f} ms, "
+          f"p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+    print(f"state {result['digest']}")
+    if result["matches"] is not None:
+        print("state matches the recording" if result["matches"] else "STATE DIFFERS from the recording")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DOOM - Python Edition")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="headless run along a scripted path through every level")
+    parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES,
+                        help="frames per level for --benchmark")
+    parser.add_argument("--max-fps", type=int, default=MAX_FPS,
+                        help="frame cap, 0 for uncapped")
+    parser.add_argument("--sim-hz", type=int, default=SIM_HZ,
+                        help="fixed simulation rate")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="stream per-frame stage timings to PATH (.csv, otherwise JSON Lines)")
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS,
+                        help="threads for column rendering, 1 to render on the main thread")
+    parser.add_argument("--flat-divisor", type=int, default=FLAT_DIVISOR,
+                        help="floor/ceiling resolution divisor, 0 for flat colour fill")
+    parser.add_argument("--dynamic-resolution", action="store_true",
+                        help="adjust ray count and floor resolution to hold --target-ms")
+    parser.add_argument("--target-ms", type=float, default=1000 / MAX_FPS,
+                        help="frame-time budget for --dynamic-resolution")
+    parser.add_argument("--min-rays", type=int, default=0, help="lower ray-count bound for --dynamic-resolution")
+    parser.add_argument("--max-rays", type=int, default=NUM_RAYS,
+                        help="upper ray-count bound for --dynamic-resolution")
+    parser.add_argument("--level", metavar="PATH",
+                        help="play or benchmark this level file instead of the built-in levels")
+    parser.add_argument("--generate", metavar="WxH",
+                        help="generate a random level of this size (64x64 .. 1024x1024) and use it")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for --generate and for the random wall textures")
+    parser.add_argument("--room-density", type=float, default=0.35,
+                        help="share of the map covered by rooms for --generate")
+    parser.add_argument("--corridor-density", type=float, default=0.25,
+                        help="share of rooms with an extra loop corridor for --generate")
+    parser.add_argument("--enemies", type=int,
+                        help="enemy count for --generate (default: one per 40 free tiles)")
+    parser.add_argument("--pickup-density", type=float, default=0.01,
+                        help="pickups per free tile for --generate")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record per-tick input and the seed to PATH for --replay")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="replay a --record file tick by tick and report frame times and the state hash")
+    parser.add_argument("--headless", action="store_true",
+                        help="no window (with --replay, or with --startup-report to exit after the first frame)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print how long each startup phase took, up to the first presented frame")
+    args = parser.parse_args()
+
+    levels = None
+    if args.generate:
+        try:
+            width, height = (int(size) for size in args.generate.lower().split("x"))
+        except ValueError:
+            parser.error("--generate expects WxH, e.g. 256x256")
+        if not (64 <= width <= 1024 and 64 <= height <= 1024):
+            parser.error("--generate supports sizes from 64x64 to 1024x1024")
+        levels = [generated_level_path(width, height, seed=args.seed, room_density=args.room_density,
+                                       corridor_density=args.corridor_density, enemies=args.enemies,
+                                       pickup_density=args.pickup_density)]
+    elif args.level:
+        levels = [args.level]
+
+    scaler = None
+    if args.dynamic_resolution:
+        scaler = ResolutionScaler(args.target_ms, args.min_rays, args.max_rays)
+
+    options = dict(profile_path=args.profile, workers=args.workers, flat_divisor=args.flat_divisor,
+                   resolution_scaler=scaler)
+
+    if args.benchmark:
+        # Без фоновой сборки уровней: она отнимала бы процессор у замеряемых кадров
+        game = DoomGame(headless=True, max_fps=0, sim_hz=args.sim_hz, levels=levels,
+                        seed=args.seed, preload=False, **options)
+        print_benchmark(game.run_benchmark(args.frames))
+        if scaler is not None:
+            for frame, old, new, average in scaler.decisions:
+                (old_rays, old_divisor), (new_rays, new_divisor) = scaler.steps[old], scaler.steps[new]
+                print(f"frame {frame}: {old_rays} rays, floor /{old_divisor} -> "
+                      f"{new_rays} rays, floor /{new_divisor} (avg {average:.2f} ms)")
+        game.profiler.close()
+        game.render_pool.close()
+        game.preloader.close()
         pygame.quit()
+        return
+
+    if args.replay:
+        # Всё, от чего зависит состояние игры, берём из записи
+        try:
+            header, records, recorded_digest = InputRecorder.read(args.replay)
+            replay_levels = InputRecorder.resolve_levels(header)
+        except (OSError, ValueError) as error:
+            parser.error(f"--replay: {error}")
+        game = DoomGame(headless=args.headless, max_fps=args.max_fps, sim_hz=header["sim_hz"],
+                        levels=replay_levels, seed=header["seed"], **options)
+        print_replay(game.run_replay(records, recorded_digest))
+        game.profiler.close()
+        game.render_pool.close()
+        game.preloader.close()
+        pygame.quit()
+        return
+
+    game = DoomGame(headless=args.headless, max_fps=args.max_fps, sim_hz=args.sim_hz, levels=levels,
+                    seed=args.seed, record_path=args.record, startup_report=args.startup_report, **options)
+    game.run()
 
 
 if __name__ == "__main__":
-    game = DoomGame()
-    game.run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""Быстрые пути движка должны давать то же, что и эталонные: пачка лучей — как
+cast_ray, пакетная проверка отрезков — как скалярная, кадр по полосам — как
+в одном потоке, а повтор записи ввода — то же состояние игры"""
+import math
+import random
+
+import numpy as np
+import pygame
+import pytest
+
+import main
+
+
+def make_game(**options) -> main.DoomGame:
+    game = main.DoomGame(headless=True, max_fps=0, preload=False, **options)
+    game.ensure_level()
+    game.game_state = "playing"
+    return game
+
+
+def close_game(game: main.DoomGame):
+    game.render_pool.close()
+    game.preloader.close()
+    if game.recorder is not None:
+        game.recorder.close(game.state_digest())
+
+
+@pytest.fixture
+def game():
+    game = make_game()
+    yield game
+    close_game(game)
+
+
+def free_points(game: main.DoomGame, count: int, rng: np.random.Generator) -> np.ndarray:
+    """Случайные точки внутри свободных тайлов текущего уровня"""
+    free_y, free_x = np.nonzero(game.raycaster.grid == 0)
+    picked = rng.integers(len(free_x), size=count)
+    return np.column_stack([free_x[picked] + rng.random(count), free_y[picked] + rng.random(count)])
+
+
+@pytest.mark.parametrize("level_num", [1, 2, 3])
+def test_cast_matches_cast_ray(game, level_num):
+    game.load_level(level_num)
+    rng = np.random.default_rng(level_num)
+    # Случайные лучи и лучи вдоль линий сетки
+    angles = np.concatenate([rng.random(200) * 2 * math.pi, np.arange(8) * math.pi / 4])
+    for px, py in free_points(game, 20, rng):
+        game.player.pos.x, game.player.pos.y = px, py
+        depth, wall_type, horizontal, offset = game.raycaster.cast(px, py, angles)
+        expected = np.array([game.cast_ray(angle) for angle in angles.tolist()])
+        np.testing.assert_allclose(depth, expected[:, 0], rtol=1e-9, atol=1e-9)
+        # cast_ray помечает горизонтальные стены отрицательным типом
+        np.testing.assert_array_equal(np.where(horizontal, -wall_type, wall_type), expected[:, 1].astype(int))
+        np.testing.assert_allclose(offset, expected[:, 2], rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("level_num", [1, 2, 3])
+def test_segments_blocked_matches_segment_blocked(game, level_num):
+    game.load_level(level_num)
+    rng = np.random.default_rng(level_num)
+    starts = free_points(game, 500, rng)
+    ends = free_points(game, 500, rng)
+    raycaster = game.raycaster
+    blocked = raycaster.segments_blocked(starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1])
+    expected = [raycaster.segment_blocked(x0, y0, x1, y1)
+                for (x0, y0), (x1, y1) in zip(starts.tolist(), ends.tolist())]
+    assert blocked.tolist() == expected
+    # Из одной точки ко многим — как в handle_shooting
+    x0, y0 = starts[0]
+    blocked = raycaster.segments_blocked(x0, y0, ends[:, 0], ends[:, 1])
+    assert blocked.tolist() == [raycaster.segment_blocked(x0, y0, x1, y1) for x1, y1 in ends.tolist()]
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_strip_rendering_matches_single_thread(game, workers):
+    rng = np.random.default_rng(workers)
+    poses = [(x, y, angle) for (x, y), angle in zip(free_points(game, 5, rng), rng.random(5) * 2 * math.pi)]
+
+    def frames():
+        rendered = []
+        for x, y, angle in poses:
+            game.player.pos.x, game.player.pos.y, game.player.angle = x, y, angle
+            game.player.save_pose()
+            game.render_frame()
+            rendered.append(pygame.surfarray.array3d(game.screen))
+        return rendered
+
+    game.render_pool.close()
+    game.render_pool = main.StripPool(1)
+    single = frames()
+    game.render_pool = main.StripPool(workers)
+    for expected, frame in zip(single, frames()):
+        np.testing.assert_array_equal(frame, expected)
+
+
+def test_replay_reproduces_recorded_state(tmp_path):
+    path = str(tmp_path / "session.rec")
+    game = make_game(seed=5, record_path=path)
+    rng = random.Random(0)
+    for tick in range(240):
+        if tick == 120:
+            game.restart(1)
+            game.game_state = "playing"
+        if game.game_state != "playing":
+            break
+        game.sim_step(main.InputState(forward=rng.choice([-1, 0, 1, 1]), strafe=rng.choice([-1, 0, 1]),
+                                      turn=rng.choice([0.0, 0.0, 6.0, -4.5]), fire=rng.random() < 0.2))
+    digest = game.state_digest()
+    close_game(game)
+
+    header, records, recorded_digest = main.InputRecorder.read(path)
+    assert recorded_digest == digest
+    replay = main.DoomGame(headless=True, max_fps=0, preload=False, sim_hz=header["sim_hz"],
+                           levels=main.InputRecorder.resolve_levels(header), seed=header["seed"])
+    try:
+        result = replay.run_replay(records, recorded_digest)
+    finally:
+        close_game(replay)
+    assert result["matches"]
+
+
+def test_replay_regenerates_generated_level(tmp_path):
+    path = str(tmp_path / "generated.rec")
+    level = main.generated_level_path(64, 64, seed=77)
+    game = make_game(levels=[level], record_path=path)
+    for tick in range(60):
+        game.sim_step(main.InputState(forward=1, turn=3.0, fire=tick % 4 == 0))
+    close_game(game)
+
+    # Кэш сгенерированных уровней не переносится между копиями игры
+    main.os.remove(level)
+    header, records, recorded_digest = main.InputRecorder.read(path)
+    assert "path" not in header["levels"][0]
+    replay = main.DoomGame(headless=True, max_fps=0, preload=False, sim_hz=header["sim_hz"],
+                           levels=main.InputRecorder.resolve_levels(header), seed=header["seed"])
+    try:
+        result = replay.run_replay(records, recorded_digest)
+    finally:
+        close_game(replay)
+    assert result["matches"]
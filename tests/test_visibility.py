@@ -0,0 +1,50 @@
+"""PVS должен быть надмножеством точной видимости по RayCaster.segments_blocked"""
+import math
+
+import numpy as np
+import pytest
+
+import main
+
+SEGMENTS = 50000
+
+
+def level_grid(name: str) -> np.ndarray:
+    if name == "generated":
+        path = main.generated_level_path(128, 128, seed=3)
+    else:
+        path = main.os.path.join(main.LEVELS_DIR, f"{name}.json")
+    return np.asarray(main.Level(path).grid)
+
+
+@pytest.mark.parametrize("name", ["level1", "level3", "generated"])
+def test_pvs_contains_every_clear_segment(name):
+    grid = level_grid(name)
+    pvs = main.VisibilitySets(main.VisibilitySets.compile(grid))
+    size, radius, width = pvs.SIZE, pvs.RADIUS, pvs.WIDTH
+    visible = np.unpackbits(pvs.bits, axis=-1, count=width * width).reshape(pvs.rows, pvs.cols, width, width)
+
+    # Отрезки длиной до RANGE из случайных точек свободных тайлов в случайных направлениях
+    rng = np.random.default_rng(0)
+    free_y, free_x = np.nonzero(grid == 0)
+    start = rng.integers(len(free_x), size=SEGMENTS)
+    px = free_x[start] + rng.random(SEGMENTS)
+    py = free_y[start] + rng.random(SEGMENTS)
+    angle = rng.random(SEGMENTS) * 2 * math.pi
+    length = rng.random(SEGMENTS) * pvs.RANGE
+    qx = px + np.cos(angle) * length
+    qy = py + np.sin(angle) * length
+    inside = (qx >= 0) & (qy >= 0) & (qx < grid.shape[1]) & (qy < grid.shape[0])
+    px, py, qx, qy = px[inside], py[inside], qx[inside], qy[inside]
+
+    clear = ~main.RayCaster(grid).segments_blocked(px, py, qx, qy)
+    assert clear.sum() > 1000
+    source_x, source_y = px.astype(int) // size, py.astype(int) // size
+    # Виден должен быть кластер конца отрезка и кластеры соседних с ним тайлов
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            tile_x = np.clip(qx.astype(int) + dx, 0, grid.shape[1] - 1)
+            tile_y = np.clip(qy.astype(int) + dy, 0, grid.shape[0] - 1)
+            marked = visible[source_y, source_x,
+                             tile_y // size - source_y + radius, tile_x // size - source_x + radius]
+            assert not (clear & (marked == 0)).any()